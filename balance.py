@@ -0,0 +1,388 @@
+import argparse
+import math
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from main import ENEMY_SPEEDS, SIM_RATE, STEP_MS, TILE_SIZE, Controls, DistanceField, EnemySwarm, LevelLibrary, Simulation, np
+
+# Monte Carlo level balancing: plays many headless runs of each level with a scripted
+# or random policy across a process pool and reports catch rates and completion times.
+# With NumPy, each worker task plays its runs together (see RunBatch).
+#
+#   python balance.py --runs 2000 --policy seek
+#   python balance.py --levels 2 3 --policy random --workers 4
+
+DIRECTIONS = ['left', 'right', 'up', 'down']
+OFFSETS = {'left': (-1, 0), 'right': (1, 0), 'up': (0, -1), 'down': (0, 1)}
+OFFSET_DIRECTIONS = {offset: d for d, offset in OFFSETS.items()}
+
+class RandomPolicy:
+    # Holds a random direction for a random number of steps, sometimes sprinting
+    SPRINT = 0.3  # Chance of sprinting
+    HOLD = (5, 40)  # Steps a direction is held for
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.hold = 0
+        self.controls = Controls()
+
+    def read(self, sim):
+        if self.hold <= 0:
+            d = self.rng.choice(DIRECTIONS)
+            self.controls = Controls(sprint=self.rng.random() < self.SPRINT, **{d: True})
+            self.hold = self.rng.randint(*self.HOLD)
+        self.hold -= 1
+        return self.controls
+
+class SeekPolicy:
+    # Walks the shortest tile path to the nearest homework, then to a goal. Ignores the
+    # hall monitors, with a small chance of a random detour, like a hurried student.
+    DETOUR = 0.05  # Chance of a random step on entering a tile
+    SPRINT = 0.5  # Chance that a run sprints throughout
+
+    def __init__(self, rng, detour=DETOUR, sprint=SPRINT):
+        self.rng = rng
+        self.detour = detour
+        self.sprint = rng.random() < sprint
+        self.tile = None
+        self.remaining = -1
+        self.direction = None
+
+    def read(self, sim):
+        tile = (sim.player.rect.x // TILE_SIZE, sim.player.rect.y // TILE_SIZE)
+        if tile != self.tile or len(sim.homework) != self.remaining:
+            self.tile, self.remaining = tile, len(sim.homework)
+            open_dirs = [d for d in DIRECTIONS if not sim.solid_grid.is_solid(tile[0] + OFFSETS[d][0], tile[1] + OFFSETS[d][1])]
+            if open_dirs and self.rng.random() < self.detour: self.direction = self.rng.choice(open_dirs)
+            else: self.direction = self.next_direction(sim, tile)
+        if self.direction is None: return Controls()
+        return Controls(sprint=self.sprint, **{self.direction: True})
+
+    def next_direction(self, sim, tile):
+        # The simulation keeps walking distances to the homework left and to the goals, so
+        # the next step is a lookup rather than a search
+        step = (sim.homework_field if sim.homework else sim.level.goal_field).next_step(*tile)
+        if step is None: return None
+        return OFFSET_DIRECTIONS[(step[0] - tile[0], step[1] - tile[1])]
+
+POLICIES = {'random': RandomPolicy, 'seek': SeekPolicy}
+
+# Each worker process compiles a level the first time it plays it and reuses it for the rest
+LEVELS = LevelLibrary()
+
+def play(level_idx, seed, policy_name, max_seconds):
+    rng = random.Random(seed)
+    sim = Simulation(LEVELS.get(level_idx), rng)
+    policy = POLICIES[policy_name](rng)
+    max_steps = int(max_seconds * SIM_RATE)
+    while sim.status == "PLAYING" and sim.steps < max_steps:
+        sim.step(policy.read(sim))
+    outcome = {'CLEARED': 'cleared', 'FAILED': 'failed'}.get(sim.status, 'timeout')
+    return outcome, sim.steps, sim.catches
+
+# Stepping one Simulation at a time is almost all per-step Python overhead, so with NumPy the
+# runs of a task are played in lockstep as a RunBatch, one array row per run. Every row still
+# draws from its own random.Random(seed) in the same order play() does, so each seed ends
+# exactly as it would on its own (compare with --serial).
+
+TABLES = {}  # level fingerprint: LevelTables, built once per worker process
+
+class LevelTables:
+    # A level as flat arrays over its tiles plus a solid one-tile border, so the neighbour in
+    # direction d is always cell + steps[d] with no bounds checks
+    UNREACHED = 1 << 30
+    OFF_LINE = -2 * TILE_SIZE
+    CATCH_REACH = TILE_SIZE - 5  # Enemy.hitbox is the monitor's tile inset by 5px
+
+    def __init__(self, level):
+        grid = level.solid_grid
+        self.width = grid.cols + 2
+        size = self.width * (grid.rows + 2)
+        self.steps = np.array([OFFSETS[d][0] + OFFSETS[d][1] * self.width for d in DIRECTIONS])
+        self.tiles = np.array([self.cell(c, r) for r in range(grid.rows) for c in range(grid.cols)])
+        self.solid = np.ones(size, dtype=bool)
+        self.solid[self.tiles] = np.frombuffer(bytes(grid.cells), dtype=np.uint8).astype(bool)
+        # DIRECTIONS indexes that aren't walled off, padded with -1 (SeekPolicy's open_dirs)
+        self.open_dirs = np.full((size, len(DIRECTIONS)), -1)
+        self.open_count = np.zeros(size, dtype=np.int64)
+        for cell in self.tiles[~self.solid[self.tiles]].tolist():
+            dirs = np.flatnonzero(~self.solid[cell + self.steps])
+            self.open_dirs[cell, :len(dirs)] = dirs
+            self.open_count[cell] = len(dirs)
+        self.homework = np.full(size, -1)
+        self.homework[[self.cell(c, r) for c, r in level.homework]] = np.arange(len(level.homework))
+        self.goal = np.zeros(size, dtype=bool)
+        self.goal[[self.cell(c, r) for c, r in level.goals]] = True
+        # Walking distances to each paper on its own; the nearest paper left is the minimum
+        # over the papers a run still has, which is what its homework_field would hold
+        self.paper_dist = np.array([self.distances(DistanceField(grid, [tile]), size) for tile in level.homework]).reshape(-1, size)
+        self.goal_dist = self.distances(level.goal_field, size)
+        # For a player on each cell, its pixel position along each hall monitor's line, or
+        # OFF_LINE if it isn't on that line: a monitor at `pos` catches it when the two are
+        # less than CATCH_REACH apart
+        cols, rows = np.arange(size) % self.width - 1, np.arange(size) // self.width - 1
+        horizontal = np.array([axis == 'horizontal' for _, _, axis in level.enemies], dtype=bool)
+        across = np.array([r if axis == 'horizontal' else c for c, r, axis in level.enemies], dtype=np.int64)
+        on_line = np.where(horizontal, rows[:, None], cols[:, None]) == across
+        self.lines = np.where(on_line, np.where(horizontal, cols[:, None], rows[:, None]) * TILE_SIZE, self.OFF_LINE)
+
+    def cell(self, col, row): return (row + 1) * self.width + col + 1
+
+    def distances(self, field, size):
+        dist = np.full(size, self.UNREACHED)
+        dist[self.tiles] = np.where(np.array(field.dist) == DistanceField.UNREACHED, self.UNREACHED, field.dist)
+        return dist
+
+class RandomStreams:
+    # One random.Random per row, read for many rows at once. CPython builds random(), choice()
+    # and randint() from 32-bit Mersenne Twister words: random() takes two, and randbelow(n)
+    # keeps the top n.bit_length() bits of one word per try. So each row's words are drawn
+    # ahead in blocks and decoded here into exactly the values its Random would have returned.
+    BLOCK = 128  # Words held per row
+    TRIES = 8  # randbelow tries looked at per pass (each succeeds at least half the time)
+
+    def __init__(self, rngs):
+        self.rngs = np.empty(len(rngs), dtype=object)
+        self.rngs[:] = rngs
+        self.words = np.zeros((len(rngs), self.BLOCK), dtype=np.uint32)
+        self.cursor = np.full(len(rngs), self.BLOCK)
+
+    def select(self, keep):
+        self.rngs, self.words, self.cursor = self.rngs[keep], self.words[keep], self.cursor[keep]
+
+    def peek(self, rows, count):
+        # The next `count` words of each row, as a (rows, count) array, without using them up
+        for row in rows[self.cursor[rows] > self.BLOCK - count].tolist():
+            left = self.BLOCK - self.cursor[row]
+            self.words[row, :left] = self.words[row, self.cursor[row]:]
+            fresh = self.BLOCK - left
+            self.words[row, left:] = np.frombuffer(self.rngs[row].getrandbits(32 * fresh).to_bytes(4 * fresh, 'little'), dtype='<u4')
+            self.cursor[row] = 0
+        return self.words[rows[:, None], self.cursor[rows, None] + np.arange(count)]
+
+    def random(self, rows):
+        words = self.peek(rows, 2)
+        self.cursor[rows] += 2
+        return ((words[:, 0] >> 5) * 67108864.0 + (words[:, 1] >> 6)) * (1.0 / 9007199254740992.0)
+
+    def below(self, rows, n):
+        # randbelow(n) for each row (n may be an array): the first try whose bits are below n
+        # is the result, and it and the tries before it are used up
+        n = np.broadcast_to(n, rows.shape)[:, None]
+        tries = self.peek(rows, self.TRIES) >> (32 - np.frexp(n)[1]).astype(np.uint32)
+        ok = tries < n
+        first = ok.argmax(axis=1)
+        found = ok[np.arange(len(rows)), first]
+        self.cursor[rows] += np.where(found, first + 1, self.TRIES)
+        out = tries[np.arange(len(rows)), first].astype(np.int64)
+        if not found.all(): out[~found] = self.below(rows[~found], n[~found, 0])
+        return out
+
+class RunBatch:
+    # Runs of one level stepped together, following Simulation.step: the player moves, the hall
+    # monitors of every run move as one EnemySwarm, then papers, catches and goals are checked.
+    # Finished rows keep being stepped (and ignored) until an eighth of the rows are finished,
+    # then they are dropped together.
+    LIVES = 3  # As in Simulation.load
+
+    def __init__(self, level, seeds, policy_name, max_steps):
+        if level.fingerprint not in TABLES: TABLES[level.fingerprint] = LevelTables(level)
+        self.tables = TABLES[level.fingerprint]
+        self.max_steps = max_steps
+        self.total = len(level.homework)
+        self.start = self.tables.cell(*level.player_start)
+        n = len(seeds)
+        self.runs = np.arange(n)  # Index into seeds of each row
+        self.streams = RandomStreams([random.Random(seed) for seed in seeds])
+        picks = [self.streams.below(self.runs, len(ENEMY_SPEEDS)) for _ in level.enemies]
+        speeds = np.array(ENEMY_SPEEDS)[np.array(picks, dtype=np.int64).reshape(len(level.enemies), n).T]
+        self.enemies = EnemySwarm(level.enemies, speeds, level.solid_grid)
+        self.policy = BATCH_POLICIES[policy_name](self.streams, n)
+
+        self.cell = np.full(n, self.start)
+        self.move_timer = np.full(n, -Simulation.walk_delay - 1.0)
+        self.lives = np.full(n, self.LIVES)
+        self.catches = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.left = np.ones((n, self.total), dtype=bool)  # Papers not yet collected
+        self.over = np.zeros(n, dtype=bool)  # Finished, not dropped yet
+        self.running = n
+        self.steps = 0
+        self.results = [None] * n
+
+    def play(self):
+        while self.running and self.steps < self.max_steps: self.step(*self.policy.read(self))
+        for row in np.flatnonzero(~self.over).tolist(): self.results[self.runs[row]] = ('timeout', self.steps, int(self.catches[row]))
+        return self.results
+
+    def step(self, move, sprint):
+        # `move` is a DIRECTIONS index per row (-1 stands still)
+        t = self.tables
+        self.steps += 1
+        ticks = self.steps * STEP_MS
+        go = (move >= 0) & (ticks - self.move_timer > np.where(sprint, Simulation.sprint_delay, Simulation.walk_delay))
+        target = self.cell + t.steps[move]
+        self.cell = np.where(go & ~t.solid[target], target, self.cell)
+        self.move_timer[go] = ticks
+        self.enemies.update()
+
+        paper = t.homework[self.cell]
+        rows = np.flatnonzero(paper >= 0)
+        got = rows[self.left[rows, paper[rows]]]
+        self.left[got, paper[got]] = False
+        self.score[got] += 1
+
+        # Catches are rare, so rows with one are resolved one by one, in spawn order like
+        # Simulation.check_interactions (a catch sends the player back to the start)
+        pos = self.enemies.along.astype(np.int64)
+        hit = np.abs(pos - t.lines[self.cell]) < t.CATCH_REACH
+        failed = np.zeros(len(self.runs), dtype=bool)
+        for row in np.flatnonzero(hit.any(axis=1) & ~self.over).tolist():
+            i = int(hit[row].argmax())
+            while i != -1:
+                self.lives[row] -= 1
+                self.catches[row] += 1
+                if self.lives[row] == 0:
+                    failed[row] = True
+                    break
+                self.cell[row] = self.start
+                later = np.flatnonzero(np.abs(pos[row, i + 1:] - t.lines[self.start, i + 1:]) < t.CATCH_REACH)
+                i = i + 1 + int(later[0]) if later.size else -1
+        cleared = ~failed & ~self.over & t.goal[self.cell] & (self.score == self.total)
+
+        done = failed | cleared
+        if not done.any(): return
+        for row in np.flatnonzero(done).tolist():
+            self.results[self.runs[row]] = ('failed' if failed[row] else 'cleared', self.steps, int(self.catches[row]))
+        self.over |= done
+        self.running -= int(done.sum())
+        if (len(self.runs) - self.running) * 8 < len(self.runs): return
+        keep = ~self.over
+        for name in ('runs', 'cell', 'move_timer', 'lives', 'catches', 'score', 'left', 'over'): setattr(self, name, getattr(self, name)[keep])
+        self.enemies.select(keep)
+        self.streams.select(keep)
+        self.policy.select(keep)
+
+class RandomBatch:
+    # RandomPolicy for every row of a RunBatch: rows whose hold has run out draw a direction,
+    # sprint and hold, in RandomPolicy's order
+    def __init__(self, streams, n):
+        self.streams = streams
+        self.hold = np.zeros(n, dtype=np.int64)
+        self.move = np.full(n, -1)
+        self.sprint = np.zeros(n, dtype=bool)
+
+    def select(self, keep):
+        self.hold, self.move, self.sprint = self.hold[keep], self.move[keep], self.sprint[keep]
+
+    def read(self, batch):
+        due = np.flatnonzero(self.hold <= 0)
+        if due.size:
+            low, high = RandomPolicy.HOLD
+            self.move[due] = self.streams.below(due, len(DIRECTIONS))
+            self.sprint[due] = self.streams.random(due) < RandomPolicy.SPRINT
+            self.hold[due] = low + self.streams.below(due, high - low + 1)
+        self.hold -= 1
+        return self.move, self.sprint
+
+class SeekBatch:
+    # SeekPolicy for every row of a RunBatch. Rows re-plan when they enter a tile or pick up a
+    # paper: some roll a detour, and the rest look up their next step all at once.
+    def __init__(self, streams, n):
+        self.streams = streams
+        self.sprint = streams.random(np.arange(n)) < SeekPolicy.SPRINT
+        self.cell = np.full(n, -1)
+        self.score = np.full(n, -1)
+        self.move = np.full(n, -1)
+
+    def select(self, keep):
+        self.sprint, self.cell, self.score, self.move = self.sprint[keep], self.cell[keep], self.score[keep], self.move[keep]
+
+    def read(self, batch):
+        due = np.flatnonzero((batch.cell != self.cell) | (batch.score != self.score))
+        if not due.size: return self.move, self.sprint
+        t = batch.tables
+        self.cell[due], self.score[due] = batch.cell[due], batch.score[due]
+        rolled = due[t.open_count[self.cell[due]] > 0]
+        detour = rolled[self.streams.random(rolled) < SeekPolicy.DETOUR]
+        if detour.size:
+            cells = self.cell[detour]
+            self.move[detour] = t.open_dirs[cells, self.streams.below(detour, t.open_count[cells])]
+        seek = np.setdiff1d(due, detour, assume_unique=True)
+        if seek.size: self.move[seek] = self.next_moves(batch, seek)
+        return self.move, self.sprint
+
+    def next_moves(self, batch, rows):
+        # DistanceField.next_step for many rows: the first direction whose tile is one step
+        # closer to the nearest paper left (or goal, once there are none), else -1
+        t = batch.tables
+        cells = batch.cell[rows, None] + np.concatenate(([0], t.steps))
+        papers = np.where(batch.left[rows].T[:, :, None], t.paper_dist[:, cells], t.UNREACHED).min(axis=0, initial=t.UNREACHED)
+        dist = np.where((batch.score[rows] == batch.total)[:, None], t.goal_dist[cells], papers)
+        closer = dist[:, 1:] == dist[:, :1] - 1
+        return np.where(closer.any(axis=1), closer.argmax(axis=1), -1)
+
+BATCH_POLICIES = {'random': RandomBatch, 'seek': SeekBatch}
+
+def play_batch(args):
+    level_idx, seeds, policy_name, max_seconds, serial = args
+    if serial or np is None: return level_idx, [play(level_idx, seed, policy_name, max_seconds) for seed in seeds]
+    return level_idx, RunBatch(LEVELS.get(level_idx), seeds, policy_name, int(max_seconds * SIM_RATE)).play()
+
+def percentile(sorted_values, q):
+    if not sorted_values: return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def report(level_idx, results):
+    runs = len(results)
+    cleared = sorted(steps / SIM_RATE for outcome, steps, _ in results if outcome == 'cleared')
+    failed = sum(1 for outcome, _, _ in results if outcome == 'failed')
+    caught = sum(1 for _, _, catches in results if catches)
+    catches = sum(catches for _, _, catches in results)
+    print(f"Level {level_idx + 1}: {runs} runs")
+    print(f"  cleared {len(cleared) / runs:6.1%}   failed {failed / runs:6.1%}   timed out {(runs - len(cleared) - failed) / runs:6.1%}")
+    print(f"  caught at least once {caught / runs:6.1%}   catches per run {catches / runs:.2f}")
+    if cleared:
+        print(f"  completion time  min {cleared[0]:.1f}s  p10 {percentile(cleared, 0.1):.1f}s  "
+              f"p50 {percentile(cleared, 0.5):.1f}s  p90 {percentile(cleared, 0.9):.1f}s  "
+              f"mean {statistics.fmean(cleared):.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many runs of each level to check balance.")
+    parser.add_argument('--levels', type=int, nargs='+', help="level numbers to run (1-based, default: all)")
+    parser.add_argument('--runs', type=int, default=1000, help="runs per level")
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='seek')
+    parser.add_argument('--seed', type=int, default=0, help="base seed; run i uses seed + i")
+    parser.add_argument('--max-seconds', type=float, default=120, help="simulated time limit per run")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch', type=int, help="runs per worker task (default: as many as keeps every worker busy)")
+    parser.add_argument('--serial', action='store_true', help="play each run through its own Simulation (slow; to check RunBatch)")
+    args = parser.parse_args()
+
+    levels = [n - 1 for n in args.levels] if args.levels else list(range(len(LEVELS)))
+    # Bigger batches step faster, so each level is split into no more tasks than the workers need
+    if args.batch is None: args.batch = math.ceil(args.runs / math.ceil(args.workers / len(levels)))
+    tasks = []
+    for level_idx in levels:
+        for start in range(0, args.runs, args.batch):
+            seeds = range(args.seed + start, args.seed + min(args.runs, start + args.batch))
+            tasks.append((level_idx, seeds, args.policy, args.max_seconds, args.serial))
+
+    results = {level_idx: [] for level_idx in levels}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for level_idx, batch in pool.map(play_batch, tasks):
+            results[level_idx].extend(batch)
+    elapsed = time.perf_counter() - started
+
+    for level_idx in levels: report(level_idx, results[level_idx])
+    total = sum(len(r) for r in results.values())
+    print(f"{total} runs in {elapsed:.1f}s ({total / elapsed:.0f} runs/s, {args.workers} workers)")
+
+if __name__ == "__main__":
+    main()
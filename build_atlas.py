@@ -0,0 +1,52 @@
+import json
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from main import ASSET_FILES, ATLAS_IMAGE, ATLAS_INDEX, TILE_SIZE, asset_size
+
+# Packs every sprite in ASSET_FILES, already scaled to its in-game size, into one
+# image plus a JSON index of where each sprite sits. The game loads this single
+# file instead of decoding and scaling each full-size PNG at startup.
+#
+#   python build_atlas.py
+
+ATLAS_WIDTH = 256
+
+def pack(sprites):
+    # Simple shelf packing: tallest first, left to right, new row when the width runs out
+    placed = {}
+    x = y = shelf_height = 0
+    for name, image in sorted(sprites.items(), key=lambda item: -item[1].get_height()):
+        w, h = image.get_size()
+        if x + w > ATLAS_WIDTH:
+            x, y = 0, y + shelf_height
+            shelf_height = 0
+        placed[name] = [x, y, w, h]
+        x += w
+        shelf_height = max(shelf_height, h)
+    return placed, y + shelf_height
+
+def main():
+    sprites = {}
+    for name, filename in ASSET_FILES.items():
+        path = os.path.join("assets", filename)
+        if not os.path.exists(path):
+            print(f"skipping {name}: {path} not found")
+            continue
+        sprites[name] = pygame.transform.scale(pygame.image.load(path), asset_size(name))
+
+    placed, height = pack(sprites)
+    atlas = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA)
+    for name, (x, y, _, _) in placed.items():
+        atlas.blit(sprites[name], (x, y))
+
+    pygame.image.save(atlas, ATLAS_IMAGE)
+    with open(ATLAS_INDEX, 'w') as f:
+        json.dump({'tile_size': TILE_SIZE, 'sprites': placed}, f, indent=2, sort_keys=True)
+    print(f"wrote {ATLAS_IMAGE} ({ATLAS_WIDTH}x{height}, {len(placed)} sprites) and {ATLAS_INDEX}")
+
+if __name__ == "__main__":
+    main()
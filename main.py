@@ -2,14 +2,85 @@ import pygame
 import sys
 import math
 import asyncio
+import time
 import os
+import json
 import random
+import heapq
+import argparse
+import csv
+import hashlib
+from bisect import bisect_right
+from array import array
+from collections import OrderedDict
+
+# NumPy is optional: confetti and large patrols fall back to plain Python without it. The browser
+# build never imports it, since pygbag would fetch the whole package before the game starts.
+np = None
+if sys.platform != 'emscripten':
+    try:
+        import numpy as np
+    except ImportError:
+        pass
 
 # --- CONFIGURATION ---
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 TILE_SIZE = 40
 FPS = 60
+SIM_RATE = 60  # Simulation steps per second (enemy speeds are in pixels per step)
+MAX_STEPS_PER_FRAME = 5
+STEP_MS = 1000 / SIM_RATE
+ENEMY_SPEEDS = [0.8, 1.0, 1.2, 1.5]  # Hall monitor speeds, picked per enemy when a level loads
+ENEMY_BATCH_MIN = 32  # Levels with at least this many hall monitors step them as NumPy arrays
+HUD_HEIGHT = 40
+TEXT_CACHE_SIZE = 64
+CHUNK_TILES = 8  # Map chunks are baked as CHUNK_TILES x CHUNK_TILES tile surfaces
+LEVEL_CHUNK_CACHE = 48  # Most chunks kept baked at once (a screen needs about 12)
+CONFETTI_COUNT = 100
+
+# Direction presses are queued until the move timer lets the player take them (see KeyboardInput)
+INPUT_BUFFER_SIZE = 3  # Most direction presses waiting at once
+INPUT_BUFFER_MS = 250  # A press not taken within this long of reaching the front of the queue is dropped
+
+# Opt-in partial display updates while PLAYING (other screens always flip the full frame)
+DIRTY_RENDERING = False
+
+# Render scale: frames are drawn at SCREEN_WIDTH x SCREEN_HEIGHT and pushed to a display this many
+# times that size (below 1 on slow devices, 2 for crisp HiDPI). 'auto' adapts it to hold FPS in the
+# browser build; on desktop it stays at 1.
+RENDER_SCALE = 1.0
+RENDER_SCALES = (0.5, 0.625, 0.75, 0.875, 1.0, 1.5, 2.0)  # Steps 'auto' moves between
+RENDER_SCALE_HOLD = 30  # Frames the frame time must stay out of bounds before 'auto' steps
+
+# Frame profiler: F3 toggles it with its overlay, F4 saves the recorded frames as a trace
+PROFILE_FRAMES = 3600  # Frames of per-phase timings kept (a minute at 60 FPS)
+PROFILE_GRAPH_FRAMES = 240  # Frames shown in the overlay's frame-time graph
+PROFILE_OVERLAY_REFRESH = 15  # Frames between overlay redraws
+
+# --- ASSETS ---
+ASSET_FILES = {
+    'player': 'player.png',
+    'wall': 'wall.png',
+    'floor': 'floor.png',
+    'homework': 'homework.png',
+    'enemy': 'enemy.png',
+    'door': 'door.png',
+    'desk': 'desk.png',
+    'heart': 'heart.png',
+    'compass': 'compass.png'
+}
+# Pre-scaled sprite sheet written by build_atlas.py
+ATLAS_IMAGE = os.path.join("assets", "atlas.png")
+ATLAS_INDEX = os.path.join("assets", "atlas.json")
+
+def asset_size(name):
+    return (25, 25) if name in ['heart', 'compass'] else (TILE_SIZE, TILE_SIZE)
+
+# --- FONTS ---
+FONT_FILE = os.path.join("assets", "fonts", "DejaVuSans-Bold.ttf")
+# Every character the HUD, timer and touch labels use; glyphs for these are rendered up front
+GLYPH_CHARSET = "".join(chr(c) for c in range(32, 127)) + "▲▼◀▶"
 
 # --- COLORS ---
 BLACK = (15, 15, 25)
@@ -25,6 +96,9 @@ HEART_RED = (255, 50, 50)
 TOUCH_BG = (50, 50, 50, 150) 
 TOUCH_ACTIVE = (100, 100, 100, 180)
 
+# Sprite drawn for each kind of entity, and the shape color used until it has loaded
+SPRITE_STYLES = {'homework': ('homework', WHITE), 'enemy': ('enemy', RED), 'player': ('player', GATOR_GREEN)}
+
 # --- MAPS ---
 LEVEL_1_HALLWAY = [
     "WWWWWWWWWWWWWWWWWWWW",
@@ -84,8 +158,244 @@ LEVEL_4_CEREMONY = [
 
 ALL_LEVELS = [LEVEL_1_HALLWAY, LEVEL_2_CLASSROOMS, LEVEL_3_CAFETERIA, LEVEL_4_CEREMONY]
 
+# Extra levels are picked up from JSON files in this folder (see LevelLibrary)
+LEVEL_DIR = "levels"
+LEVEL_CACHE_SIZE = 16
+LEVEL_PREFETCH = 2  # Levels after the current one that are compiled in the background
+DAILY_LEVELS = 5  # Generated levels in the daily challenge
+
+REPLAY_DIR = "replays"  # Every finished run is saved here (see Replay)
+SAVE_REPLAYS = True
+REPLAY_SNAPSHOT_STEPS = 600  # Replay seeking keeps a simulation snapshot every 10 s of play
+REPLAY_SEEK_STEPS = 300  # Left/Right during playback jump 5 s
+
+def merge_rects(rects):
+    # Union overlapping rects until none overlap
+    merged = []
+    for r in rects:
+        r = pygame.Rect(r)
+        i = r.collidelist(merged)
+        while i != -1:
+            r.union_ip(merged.pop(i))
+            i = r.collidelist(merged)
+        merged.append(r)
+    return merged
+
+def load_font(size):
+    # The bundled font looks the same on every platform and skips SysFont's system font scan
+    if os.path.exists(FONT_FILE): return pygame.font.Font(FONT_FILE, size)
+    return pygame.font.Font(None, size)
+
+class GlyphCache:
+    # Pre-rendered glyphs for one font and color. Strings are drawn as a row of glyph
+    # blits, so HUD text that changes (timer, messages) never goes back to the rasterizer.
+    def __init__(self, font, color, charset=GLYPH_CHARSET):
+        self.font, self.color = font, color
+        self.height = font.get_height()
+        self.glyphs = {}
+        for ch in charset: self.add(ch)
+
+    def add(self, ch):
+        surface = self.font.render(ch, True, self.color)
+        metrics = self.font.metrics(ch)[0]
+        self.glyphs[ch] = (surface, metrics[4] if metrics else surface.get_width())
+        return self.glyphs[ch]
+
+    def width(self, text):
+        glyphs = self.glyphs
+        return sum((glyphs.get(ch) or self.add(ch))[1] for ch in text)
+
+    def draw(self, target, text, pos):
+        x, y = pos
+        blits = []
+        for ch in text:
+            surface, advance = self.glyphs.get(ch) or self.add(ch)
+            blits.append((surface, (x, y)))
+            x += advance
+        target.fblits(blits)
+
+class FrameProfiler:
+    # Per-phase frame timings in a ring buffer of the last `frames` frames. The game calls
+    # lap(phase) as each phase of a frame finishes and the time since the previous lap is
+    # charged to that phase (phases that run several times a frame add up).
+    PHASES = ('events', 'input', 'sim', 'interactions', 'draw', 'flip', 'idle')
+
+    def __init__(self, frames=PROFILE_FRAMES):
+        self.enabled = False
+        self.frames = frames
+        self.slot = {phase: i for i, phase in enumerate(self.PHASES)}
+        self.samples = array('d', bytes(8 * frames * len(self.PHASES)))
+        self.current = [0.0] * len(self.PHASES)
+        self.count = 0  # Frames recorded since the profiler was created
+        self.last = 0.0
+
+    def start_frame(self, now):
+        self.last = now
+        self.current = [0.0] * len(self.PHASES)
+
+    def lap(self, phase):
+        if not self.enabled: return
+        now = time.perf_counter()
+        self.current[self.slot[phase]] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled: return
+        n = len(self.PHASES)
+        i = (self.count % self.frames) * n
+        self.samples[i:i + n] = array('d', self.current)
+        self.count += 1
+
+    def recorded(self, last=None):
+        # Per-phase seconds of the most recent frames (all kept frames by default), oldest first
+        n = len(self.PHASES)
+        kept = min(self.count, self.frames, last or self.frames)
+        rows = []
+        for f in range(self.count - kept, self.count):
+            i = (f % self.frames) * n
+            rows.append(self.samples[i:i + n])
+        return rows
+
+    def summary(self, last=None):
+        # Frame-time percentiles and per-phase means, in milliseconds
+        rows = self.recorded(last)
+        if not rows: return None
+        totals = sorted(sum(row) for row in rows)
+        pick = lambda q: totals[min(len(totals) - 1, int(q * len(totals)))] * 1000
+        means = {phase: sum(row[i] for row in rows) * 1000 / len(rows) for i, phase in enumerate(self.PHASES)}
+        return {'frames': len(rows), 'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99),
+                'max': totals[-1] * 1000, 'phases': means}
+
+    def dump(self, path):
+        # .json gets the summary plus every frame; anything else is written as CSV. Times are in ms.
+        rows = [[round(t * 1000, 3) for t in row] for row in self.recorded()]
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.json'):
+                json.dump({'phases': list(self.PHASES), 'summary': self.summary(), 'frames': rows}, f)
+                return
+            writer = csv.writer(f)
+            writer.writerow(['frame', *self.PHASES, 'total'])
+            first = self.count - len(rows)
+            for i, row in enumerate(rows): writer.writerow([first + i, *row, round(sum(row), 3)])
+
+class ResolutionScaler:
+    # Picks the render scale for 'auto' from measured frame times, with hysteresis: a step down
+    # once frames have run over budget for RENDER_SCALE_HOLD frames in a row, a step up once the
+    # loop has been mostly idle for `up_hold` frames. Every step down after a step up doubles
+    # up_hold, so a scale the device can't quite hold is retried less and less often.
+    DOWN_AT = 1.15  # Frame time (start to start) as a multiple of the 1/FPS budget
+    UP_AT = 0.5  # Busy time (before the loop sleeps)
+
+    def __init__(self, scales, start=1.0):
+        self.scales = scales
+        self.index = max(i for i, scale in enumerate(scales) if scale <= start) if start >= scales[0] else 0
+        self.up_hold = RENDER_SCALE_HOLD * 4
+        self.stepped_up = False
+        self.reset()
+
+    @property
+    def scale(self): return self.scales[self.index]
+
+    def reset(self):
+        self.frame_avg = self.busy_avg = None
+        self.over = self.under = 0
+
+    def update(self, frame_time, busy_time):
+        # Returns True when the scale has changed
+        if self.frame_avg is None: self.frame_avg, self.busy_avg = frame_time, busy_time
+        self.frame_avg += (frame_time - self.frame_avg) * 0.1
+        self.busy_avg += (busy_time - self.busy_avg) * 0.1
+        budget = 1.0 / FPS
+        self.over = self.over + 1 if self.frame_avg > budget * self.DOWN_AT else 0
+        self.under = self.under + 1 if self.busy_avg < budget * self.UP_AT else 0
+        if self.over >= RENDER_SCALE_HOLD and self.index > 0:
+            if self.stepped_up: self.up_hold = min(self.up_hold * 2, RENDER_SCALE_HOLD * 64)
+            self.index, self.stepped_up = self.index - 1, False
+        elif self.under >= self.up_hold and self.index < len(self.scales) - 1:
+            self.index, self.stepped_up = self.index + 1, True
+        else:
+            return False
+        self.reset()
+        return True
+
+def screen_pixel_ratio():
+    # Device pixels per CSS pixel in the browser build (2 or more on HiDPI screens); 1 elsewhere
+    if sys.platform != 'emscripten': return 1.0
+    try:
+        import platform
+        return float(platform.window.devicePixelRatio)
+    except Exception:
+        return 1.0
+
+class TextCache:
+    # Rendered text surfaces keyed by (font, string, color), least recently used evicted first
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_size: self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+class ConfettiSystem:
+    # Struct-of-arrays particles: one array per field instead of a dict per particle.
+    # Every particle's sprite (colored square or scaled compass) is built once per
+    # (type, color, size) and the whole frame is drawn with a single fblits call.
+    COLORS = [GOLD, WHITE, GATOR_GREEN, RED]
+
+    def __init__(self, count, compass=None, rng=None):
+        self.rng = rng if rng is not None else random.Random()
+        self.count = count
+        xs = [self.rng.randint(0, SCREEN_WIDTH) for _ in range(count)]
+        ys = [self.rng.randint(-SCREEN_HEIGHT, 0) for _ in range(count)]
+        speeds = [self.rng.randint(2, 6) for _ in range(count)]
+        if np is not None:
+            self.x, self.y, self.speed = (np.array(v, dtype=np.float64) for v in (xs, ys, speeds))
+        else:
+            self.x, self.y, self.speed = (array('d', v) for v in (xs, ys, speeds))
+
+        sprite_cache = {}
+        self.sprites = []
+        for _ in range(count):
+            color = self.rng.choice(self.COLORS)
+            size = self.rng.randint(5, 10)
+            kind = self.rng.choice(['rect', 'compass']) if compass else 'rect'
+            key = (kind, color if kind == 'rect' else None, size)
+            if key not in sprite_cache:
+                if kind == 'compass':
+                    sprite_cache[key] = pygame.transform.scale(compass, (size*2, size*2))
+                else:
+                    sprite_cache[key] = pygame.Surface((size, size))
+                    sprite_cache[key].fill(color)
+            self.sprites.append(sprite_cache[key])
+
+    def update(self):
+        if np is not None:
+            self.y += self.speed
+            fallen = np.flatnonzero(self.y > SCREEN_HEIGHT)
+            if fallen.size:
+                self.y[fallen] = [self.rng.randint(-100, -10) for _ in range(fallen.size)]
+                self.x[fallen] = [self.rng.randint(0, SCREEN_WIDTH) for _ in range(fallen.size)]
+            return
+        x, y, speed = self.x, self.y, self.speed
+        for i in range(self.count):
+            y[i] += speed[i]
+            if y[i] > SCREEN_HEIGHT:
+                y[i] = self.rng.randint(-100, -10)
+                x[i] = self.rng.randint(0, SCREEN_WIDTH)
+
+    def draw(self, screen):
+        screen.fblits(zip(self.sprites, zip(self.x.tolist(), self.y.tolist())))
+
 class TouchController:
-    def __init__(self):
+    def __init__(self, text_cache):
         self.size = 65  
         gap = 15
         
@@ -116,120 +426,375 @@ class TouchController:
         # "GO" button (Start/Action)
         self.btn_action = pygame.Rect(SCREEN_WIDTH - 110, action_y, 80, 80)
         
-        self.font = pygame.font.SysFont('Arial', 24, bold=True) # Slightly larger arrows
+        self.font = load_font(24) # Slightly larger arrows
+        self.text_cache = text_cache
 
-    def get_active_buttons(self):
-        active = set()
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()[0]
-        
-        if mouse_pressed:
-            if self.btn_up.collidepoint(mouse_pos): active.add('UP')
-            if self.btn_down.collidepoint(mouse_pos): active.add('DOWN')
-            if self.btn_left.collidepoint(mouse_pos): active.add('LEFT')
-            if self.btn_right.collidepoint(mouse_pos): active.add('RIGHT')
-            if self.btn_sprint.collidepoint(mouse_pos): active.add('SPRINT')
-            if self.btn_action.collidepoint(mouse_pos): active.add('ACTION')
-        return active
+        # name -> (rect, label, idle color, pressed color)
+        self.buttons = {
+            'UP': (self.btn_up, "▲", TOUCH_BG, TOUCH_ACTIVE),
+            'DOWN': (self.btn_down, "▼", TOUCH_BG, TOUCH_ACTIVE),
+            'LEFT': (self.btn_left, "◀", TOUCH_BG, TOUCH_ACTIVE),
+            'RIGHT': (self.btn_right, "▶", TOUCH_BG, TOUCH_ACTIVE),
+            'SPRINT': (self.btn_sprint, "RUN", (200, 180, 50, 150), (200, 180, 50, 220)), # Yellowish
+            'ACTION': (self.btn_action, "GO", (50, 180, 100, 150), (50, 180, 100, 220)), # Greenish
+        }
+        # Each button is rendered once per state; draw() only blits the small button surfaces
+        self.sprites = {}
+        for name, (rect, label, color, pressed_color) in self.buttons.items():
+            self.sprites[name] = (self.render_button(rect, label, color), self.render_button(rect, label, pressed_color))
 
-    def draw(self, screen):
-        s = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        
-        def draw_btn(rect, label, color=TOUCH_BG):
-            pygame.draw.rect(s, color, rect, border_radius=15)
-            pygame.draw.rect(s, WHITE, rect, width=2, border_radius=15)
-            if label:
-                text = self.font.render(label, True, WHITE)
-                s.blit(text, (rect.centerx - text.get_width()//2, rect.centery - text.get_height()//2))
-
-        # D-Pad
-        draw_btn(self.btn_up, "▲")
-        draw_btn(self.btn_down, "▼")
-        draw_btn(self.btn_left, "◀")
-        draw_btn(self.btn_right, "▶")
-        
-        # Action Buttons
-        draw_btn(self.btn_sprint, "RUN", (200, 180, 50, 150)) # Yellowish
-        draw_btn(self.btn_action, "GO", (50, 180, 100, 150)) # Greenish 
-        
-        screen.blit(s, (0,0))
+        # Which button each finger (or the mouse) is holding, kept up to date from events
+        self.pointers = {}
+        self.active = frozenset()
+        self.changed_rects = []
+        self.on_change = None  # Called with (button name, pressed) on every press and release
+        self.pointer_scale = 1.0  # Display pixels per screen pixel (see Game.set_render_scale)
+
+    def render_button(self, rect, label, color):
+        s = pygame.Surface(rect.size, pygame.SRCALPHA)
+        local = s.get_rect()
+        pygame.draw.rect(s, color, local, border_radius=15)
+        pygame.draw.rect(s, WHITE, local, width=2, border_radius=15)
+        if label:
+            text = self.text_cache.render(self.font, label, WHITE)
+            s.blit(text, (local.centerx - text.get_width()//2, local.centery - text.get_height()//2))
+        return s
+
+    def button_at(self, pos):
+        for name, (rect, _, _, _) in self.buttons.items():
+            if rect.collidepoint(pos): return name
+        return None
+
+    def handle_event(self, event):
+        if event.type in (pygame.FINGERDOWN, pygame.FINGERMOTION):
+            pointer = ('finger', event.touch_id, event.finger_id)
+            self.press(pointer, (event.x * SCREEN_WIDTH, event.y * SCREEN_HEIGHT))
+        elif event.type == pygame.FINGERUP:
+            self.release(('finger', event.touch_id, event.finger_id))
+        # Mouse events synthesized from touches are already covered by the finger events
+        elif getattr(event, 'touch', False):
+            return
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            self.press('mouse', (event.pos[0] / self.pointer_scale, event.pos[1] / self.pointer_scale))
+        elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
+            self.press('mouse', (event.pos[0] / self.pointer_scale, event.pos[1] / self.pointer_scale))
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+            self.release('mouse')
+
+    def press(self, pointer, pos):
+        name = self.button_at(pos)
+        if name is None: self.pointers.pop(pointer, None)
+        else: self.pointers[pointer] = name
+        self.refresh()
+
+    def release(self, pointer):
+        self.pointers.pop(pointer, None)
+        self.refresh()
+
+    def refresh(self):
+        active = frozenset(self.pointers.values())
+        if active != self.active:
+            for name in active ^ self.active:
+                self.changed_rects.append(self.buttons[name][0])
+                if self.on_change: self.on_change(name, name in active)
+            self.active = active
+
+    def pop_changed_rects(self):
+        rects, self.changed_rects = self.changed_rects, []
+        return rects
+
+    def draw(self, screen, areas=None):
+        for name, (rect, _, _, _) in self.buttons.items():
+            sprite = self.sprites[name][name in self.active]
+            if areas is None:
+                screen.blit(sprite, rect)
+                continue
+            for r in areas:
+                clip = rect.clip(r)
+                if clip.w and clip.h: screen.blit(sprite, clip, clip.move(-rect.x, -rect.y))
+
+class Controls:
+    # One step's worth of player intent, produced by an input source
+    FIELDS = ('left', 'right', 'up', 'down', 'sprint', 'action')
+
+    def __init__(self, left=False, right=False, up=False, down=False, sprint=False, action=False):
+        self.left, self.right, self.up, self.down = left, right, up, down
+        self.sprint, self.action = sprint, action
+
+    def to_bits(self):
+        # One bit per field, in FIELDS order (used by replays)
+        return sum(1 << i for i, name in enumerate(self.FIELDS) if getattr(self, name))
+
+    def set_bits(self, bits):
+        # In place, so an input source can hand out the same Controls every step
+        self.left, self.right, self.up, self.down = bits & 1 != 0, bits & 2 != 0, bits & 4 != 0, bits & 8 != 0
+        self.sprint, self.action = bits & 16 != 0, bits & 32 != 0
+        return self
+
+    @classmethod
+    def from_bits(cls, bits):
+        return cls().set_bits(bits)
+
+DIRECTION_BITS = 0b1111  # left, right, up and down in Controls bits
+
+class KeyboardInput:
+    # Input source for the real game: keyboard plus the on-screen touch buttons. Key and touch
+    # presses and releases are taken from the event queue as they arrive instead of polling
+    # what is held once a frame, so a tap that starts and ends between two steps still counts
+    # for one. Direction presses are also queued with the time they arrived and fed to the
+    # simulation one at a time as soon as its move timer allows, so a press that lands
+    # mid-move is taken as the next move instead of being lost.
+    KEYS = {pygame.K_LEFT: 1, pygame.K_RIGHT: 2, pygame.K_UP: 4, pygame.K_DOWN: 8,
+            pygame.K_LSHIFT: 16, pygame.K_RSHIFT: 16, pygame.K_SPACE: 32, pygame.K_RETURN: 32}
+    BUTTONS = {'LEFT': 1, 'RIGHT': 2, 'UP': 4, 'DOWN': 8, 'SPRINT': 16, 'ACTION': 32}
+
+    def __init__(self, touch_controls):
+        self.touch_controls = touch_controls
+        touch_controls.on_change = self.button_edge
+        self.down = {}  # Held key (int) or touch button (str) -> its Controls bit
+        self.held = 0  # Controls bits of everything held
+        self.pressed = 0  # Bits pressed since the last read, even if already released
+        # Ring buffer of queued direction presses: Controls bit and clock() time of each
+        self.clock = time.perf_counter
+        self.queue_bits = array('B', bytes(INPUT_BUFFER_SIZE))
+        self.queue_times = array('d', bytes(8 * INPUT_BUFFER_SIZE))
+        self.queue_start = 0
+        self.queue_len = 0
+        self.head_since = 0.0  # When the last queued press was taken; the next one waits from then
+        self.queued_sim = None
+        self.queued_timer = None  # The sim's move_timer when the queue's first press was last sent
+        self.controls = Controls()
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+            bit = self.KEYS.get(event.key)
+            if bit: self.edge(event.key, bit, event.type == pygame.KEYDOWN)
+        elif event.type == pygame.WINDOWFOCUSLOST:
+            # Keys let go while another window has focus never send KEYUP
+            for key in [k for k in self.down if not isinstance(k, str)]: self.edge(key, self.down[key], False)
+
+    def button_edge(self, name, pressed):
+        self.edge(name, self.BUTTONS[name], pressed)
+
+    def edge(self, source, bit, pressed):
+        if pressed:
+            if source in self.down: return
+            self.down[source] = bit
+            self.pressed |= bit
+            if bit & DIRECTION_BITS: self.queue(bit, self.clock())
+        elif self.down.pop(source, None) is None:
+            return
+        held = 0
+        for b in self.down.values(): held |= b
+        self.held = held
+
+    def queue(self, bit, now):
+        # When full, the oldest press makes room
+        if self.queue_len == INPUT_BUFFER_SIZE:
+            self.queue_start = (self.queue_start + 1) % INPUT_BUFFER_SIZE
+            self.queue_len -= 1
+        i = (self.queue_start + self.queue_len) % INPUT_BUFFER_SIZE
+        self.queue_bits[i], self.queue_times[i] = bit, now
+        self.queue_len += 1
+
+    def pop(self):
+        self.queue_start = (self.queue_start + 1) % INPUT_BUFFER_SIZE
+        self.queue_len -= 1
+
+    def read(self, sim):
+        bits = self.held | self.pressed
+        self.pressed = 0
+        if sim is None or sim.status != "PLAYING":
+            self.queue_len, self.queued_sim = 0, None
+            return self.controls.set_bits(bits)
+
+        # The first queued press was sent last step and the player has moved since: it was taken
+        now = self.clock()
+        if self.queued_sim is sim and sim.move_timer != self.queued_timer:
+            self.pop()
+            self.head_since = now
+        # A press waits from whichever is later, being pressed or the press before it being taken,
+        # so presses queued behind others while walking aren't dropped for waiting their turn
+        while self.queue_len and (now - max(self.queue_times[self.queue_start], self.head_since)) * 1000 > INPUT_BUFFER_MS:
+            self.pop()
+        if self.queue_len:
+            # Only the queued direction is sent until the player moves, so it wins over held ones
+            bits = bits & ~DIRECTION_BITS | self.queue_bits[self.queue_start]
+            self.queued_sim, self.queued_timer = sim, sim.move_timer
+        else:
+            self.queued_sim = None
+        return self.controls.set_bits(bits)
 
 class Game:
-    def __init__(self):
+    def __init__(self, profile=None, replay=None, render_scale=RENDER_SCALE):
         pygame.init()
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Compass High: Ivan's Journey")
         self.clock = pygame.time.Clock()
         
         # Font Setup
-        self.font = pygame.font.SysFont('Arial', 20, bold=True)
-        self.big_font = pygame.font.SysFont('Arial', 50, bold=True)
-        self.title_font = pygame.font.SysFont('Arial', 70, bold=True)
+        self.font = load_font(20)
+        self.big_font = load_font(50)
+        self.title_font = load_font(70)
+        self.hud_glyphs = GlyphCache(self.font, WHITE)
+        self.text_cache = TextCache()
         
-        self.touch_controls = TouchController()
-        self.assets = {}
-        self.load_images()
+        self.touch_controls = TouchController(self.text_cache)
+
+        # Everything is drawn to self.screen at SCREEN_WIDTH x SCREEN_HEIGHT. At render scale 1 that
+        # is the display itself; otherwise present() scales it onto the display in one blit.
+        self.display = None
+        self.screen = None
+        self.scaler = None
+        if render_scale == 'auto' and sys.platform != 'emscripten': render_scale = 1.0
+        if render_scale == 'auto':
+            ratio = screen_pixel_ratio()
+            self.scaler = ResolutionScaler([s for s in RENDER_SCALES if s <= max(ratio, 1.0)], min(ratio, 1.0))
+            render_scale = self.scaler.scale
+        self.set_render_scale(render_scale)
+
+        # Sprites are loaded in the background by run(); None means "draw the fallback shape"
+        self.assets = {name: None for name in ASSET_FILES}
+        self.assets_version = 0
+
+        # Map tiles are baked into CHUNK_TILES x CHUNK_TILES surfaces on demand (LRU-bounded), and
+        # the camera (in map pixels) picks which chunks and entities end up on screen
+        self.level_chunks = OrderedDict()
+        self.level_chunks_key = None
+        self.camera = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.hud_surface = None
+        self.hud_key = None
+
+        self.render_alpha = 1.0
+
+        self.dirty_rendering = DIRTY_RENDERING
+        self.full_redraw = True
+        self.dirty_prev_frame = set()
+
+        # Profiling is off until F3 (or --profile); the trace is written on quit if a path is set
+        self.profiler = FrameProfiler()
+        self.profiler.enabled = profile is not None
+        self.profile_trace = profile or None
+        self.profile_glyphs = GlyphCache(load_font(13), WHITE)
+        self.profile_surface = None
+        self.profile_key = None
 
         self.current_level_index = 0
         self.game_state = "START_MENU"
-        self.lives = 3
         self.detentions = 0 
         self.start_ticks = 0
         self.final_time_str = "0:00"
         self.state_timer = 0
         
-        self.walls, self.desks, self.goals = [], [], []
-        self.homework_items, self.enemies = [], []
-        self.player = None
-        self.message = ""
-        self.score = 0
-        self.total_homework = 0
-
-        self.move_timer = 0
-        self.walk_delay = 150
-        self.sprint_delay = 70
-        self.confetti = []
-
-    def load_images(self):
-        files = {
-            'player': 'player.png',
-            'wall': 'wall.png',
-            'floor': 'floor.png',
-            'homework': 'homework.png',
-            'enemy': 'enemy.png',
-            'door': 'door.png',
-            'desk': 'desk.png',
-            'heart': 'heart.png',
-            'compass': 'compass.png'
-        }
-        for name, filename in files.items():
-            path = os.path.join("assets", filename)
-            if os.path.exists(path):
-                try:
-                    img = pygame.image.load(path).convert_alpha()
-                    if name in ['heart', 'compass']: self.assets[name] = pygame.transform.scale(img, (25, 25))
-                    else: self.assets[name] = pygame.transform.scale(img, (TILE_SIZE, TILE_SIZE))
-                except: self.assets[name] = None
-            else: self.assets[name] = None
+        # All level state (player, enemies, homework, lives...) lives in the headless Simulation
+        self.rng = random.Random()
+        self.levels = LevelLibrary()
+        self.mode = 'campaign'
+        self.keyboard = KeyboardInput(self.touch_controls)
+        self.input_source = self.keyboard
+        self.sim = None
+        self.confetti = None
+
+        # Each run is recorded into a Replay; with a replay given, it is played back instead
+        self.replay = None
+        self.playback = ReplayInput(replay) if replay else None
+        if self.playback: self.input_source = self.playback
+
+    async def load_images(self):
+        # Runs from run() after the first frame, so the title screen appears straight away with
+        # the colored-rect fallbacks. The packed atlas is one decode; loose files are the fallback.
+        assets = self.load_atlas()
+        if assets is None:
+            assets = {}
+            for name, filename in ASSET_FILES.items():
+                path = os.path.join("assets", filename)
+                if os.path.exists(path):
+                    try:
+                        img = pygame.image.load(path).convert_alpha()
+                        assets[name] = pygame.transform.scale(img, asset_size(name))
+                    except: assets[name] = None
+                else: assets[name] = None
+                await asyncio.sleep(0)
+        self.assets = assets
+        self.assets_version += 1
+        self.full_redraw = True
+
+    def load_atlas(self):
+        if not (os.path.exists(ATLAS_IMAGE) and os.path.exists(ATLAS_INDEX)): return None
+        try:
+            with open(ATLAS_INDEX) as f: index = json.load(f)
+            if index['tile_size'] != TILE_SIZE: return None
+            atlas = pygame.image.load(ATLAS_IMAGE).convert_alpha()
+        except: return None
+        assets = {}
+        for name in ASSET_FILES:
+            rect = index['sprites'].get(name)
+            assets[name] = atlas.subsurface(rect) if rect else None
+        return assets
+
+    def build_level_chunk(self, cx, cy):
+        # Bake the static tiles of one chunk so draw() only needs a blit per visible chunk
+        level_map = self.sim.level_map
+        c0, r0 = cx * CHUNK_TILES, cy * CHUNK_TILES
+        rows = [row[c0:c0 + CHUNK_TILES] for row in level_map[r0:r0 + CHUNK_TILES]]
+        surface = pygame.Surface((len(rows[0]) * TILE_SIZE, len(rows) * TILE_SIZE)).convert()
+        for r, row in enumerate(rows):
+            for c, tile in enumerate(row):
+                x, y = c * TILE_SIZE, r * TILE_SIZE
+                if self.assets['floor']: surface.blit(self.assets['floor'], (x, y))
+                else: pygame.draw.rect(surface, FLOOR_BLUE, (x, y, TILE_SIZE, TILE_SIZE))
+
+                if tile == 'W':
+                    if self.assets['wall']: surface.blit(self.assets['wall'], (x, y))
+                    else: pygame.draw.rect(surface, WALL_GREY, (x, y, TILE_SIZE, TILE_SIZE))
+                elif tile == 'D':
+                    if self.assets['desk']: surface.blit(self.assets['desk'], (x, y))
+                    else: pygame.draw.rect(surface, WOOD_BROWN, (x, y, TILE_SIZE, TILE_SIZE))
+                elif tile == 'O':
+                    if self.assets['door']: surface.blit(self.assets['door'], (x, y))
+                    else: pygame.draw.rect(surface, (200, 50, 50), (x, y, TILE_SIZE, TILE_SIZE))
+        return surface
+
+    def get_level_chunk(self, cx, cy):
+        key = (self.current_level_index, id(self.sim.level_map), self.assets_version)
+        if self.level_chunks_key != key:
+            self.level_chunks.clear()
+            self.level_chunks_key = key
+        chunk = self.level_chunks.get((cx, cy))
+        if chunk is None:
+            chunk = self.build_level_chunk(cx, cy)
+            self.level_chunks[(cx, cy)] = chunk
+            if len(self.level_chunks) > LEVEL_CHUNK_CACHE: self.level_chunks.popitem(last=False)
+        else:
+            self.level_chunks.move_to_end((cx, cy))
+        return chunk
+
+    def visible_chunks(self, area):
+        # (chunk surface, chunk rect in map pixels) for every chunk overlapping a map-space area
+        span = CHUNK_TILES * TILE_SIZE
+        grid = self.sim.solid_grid
+        last_cx, last_cy = (grid.cols - 1) // CHUNK_TILES, (grid.rows - 1) // CHUNK_TILES
+        for cy in range(max(0, area.top // span), min(last_cy, (area.bottom - 1) // span) + 1):
+            for cx in range(max(0, area.left // span), min(last_cx, (area.right - 1) // span) + 1):
+                chunk = self.get_level_chunk(cx, cy)
+                yield chunk, pygame.Rect((cx * span, cy * span), chunk.get_size())
+
+    def draw_level(self, area=None):
+        # Blit the map under a screen-space area (default: the whole screen)
+        area = self.screen.get_rect() if area is None else area
+        world = area.move(self.camera.topleft)
+        for chunk, chunk_rect in self.visible_chunks(world):
+            clip = chunk_rect.clip(world)
+            self.screen.blit(chunk, (clip.x - self.camera.x, clip.y - self.camera.y), clip.move(-chunk_rect.x, -chunk_rect.y))
+
+    def update_camera(self):
+        # Keep the player centred, clamped to the map edges; maps that fit on screen stay at the top-left
+        grid = self.sim.solid_grid
+        px, py = self.sim.player.rect.center
+        self.camera.x = max(0, min(px - SCREEN_WIDTH // 2, grid.cols * TILE_SIZE - SCREEN_WIDTH))
+        self.camera.y = max(0, min(py - SCREEN_HEIGHT // 2, grid.rows * TILE_SIZE - SCREEN_HEIGHT))
 
     def create_confetti(self):
-        self.confetti = []
-        for _ in range(100):
-            self.confetti.append({
-                'x': random.randint(0, SCREEN_WIDTH),
-                'y': random.randint(-SCREEN_HEIGHT, 0),
-                'speed': random.randint(2, 6),
-                'color': random.choice([GOLD, WHITE, GATOR_GREEN, RED]),
-                'size': random.randint(5, 10),
-                'type': random.choice(['rect', 'compass']) if self.assets['compass'] else 'rect'
-            })
-
-    def update_confetti(self):
-        for p in self.confetti:
-            p['y'] += p['speed']
-            if p['y'] > SCREEN_HEIGHT:
-                p['y'] = random.randint(-100, -10)
-                p['x'] = random.randint(0, SCREEN_WIDTH)
+        self.confetti = ConfettiSystem(CONFETTI_COUNT, self.assets['compass'])
 
     def get_time_string(self):
         if self.game_state == "PLAYING" or self.game_state == "LEVEL_COMPLETE":
@@ -241,134 +806,342 @@ class Game:
         s = seconds % 60
         return f"{m}:{s:02}"
 
+    def start_run(self, mode):
+        self.game_state = "PLAYING"
+        self.current_level_index = 0
+        self.detentions = 0
+        self.start_ticks = pygame.time.get_ticks()
+        # Playback runs on the recorded seeds; otherwise new_run draws fresh ones
+        replay = self.playback.replay if self.playback else None
+        if replay: seed, level_seed, self.levels = new_run(mode, replay.seed, replay.level_seed, self.levels)
+        else: seed, level_seed, self.levels = new_run(mode, levels=self.levels)
+        self.mode = mode
+        self.rng.seed(seed)
+        self.replay = Replay(seed, mode, level_seed)
+        self.load_level(0)
+
+    async def prefetch_levels(self):
+        # Compiles the next LEVEL_PREFETCH levels in the background, one per frame, so moving on
+        # to the next level (generated ones especially) never waits on the generator
+        while True:
+            busy = self.levels.prefetch(self.current_level_index + 1, LEVEL_PREFETCH)
+            await asyncio.sleep(0 if busy else 0.1)
+
     def load_level(self, level_idx):
-        self.lives = 3
-        current_map = ALL_LEVELS[level_idx]
-        self.walls, self.desks, self.goals = [], [], []
-        self.homework_items, self.enemies = [], []
-        self.start_pos = (0, 0)
-        self.score = 0
-        self.total_homework = 0
-        
-        for r, row in enumerate(current_map):
-            for c, tile in enumerate(row):
-                x, y = c * TILE_SIZE, r * TILE_SIZE
-                rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
-                if tile == 'W': self.walls.append(rect)
-                elif tile == 'D': 
-                    self.walls.append(rect)
-                    self.desks.append(rect)
-                elif tile == 'P': 
-                    self.player = Player(x, y)
-                    self.start_pos = (x, y)
-                elif tile == 'O': self.goals.append(rect)
-                elif tile == 'H': 
-                    self.homework_items.append(pygame.Rect(x+10, y+10, 20, 20))
-                    self.total_homework += 1
-                elif tile == 'E': 
-                    spd = random.choice([0.8, 1.0, 1.2, 1.5])
-                    self.enemies.append(Enemy(x, y, 'vertical', spd))
-                elif tile == 'R': 
-                    spd = random.choice([0.8, 1.0, 1.2, 1.5])
-                    self.enemies.append(Enemy(x, y, 'horizontal', spd))
-        
-        self.message = f"Homework Collected: 0/{self.total_homework}"
+        # Levels that don't compile are skipped (see LevelSource.playable)
+        self.current_level_index, level = self.levels.playable(level_idx)
+        self.sim = Simulation(level, self.rng, profiler=self.profiler)
+        self.replay.add_level(self.current_level_index, level)
+        # Bake the chunks around the spawn point up front
+        self.update_camera()
+        for _ in self.visible_chunks(self.camera): pass
+        self.full_redraw = True
 
     def handle_input(self):
-        keys = pygame.key.get_pressed()
-        touch_keys = self.touch_controls.get_active_buttons()
+        controls = self.input_source.read(self.sim)
         current_time = pygame.time.get_ticks()
-        
-        is_action = keys[pygame.K_SPACE] or keys[pygame.K_RETURN] or 'ACTION' in touch_keys
-        
-        is_shift = keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT] or 'SPRINT' in touch_keys
-        is_left  = keys[pygame.K_LEFT] or 'LEFT' in touch_keys
-        is_right = keys[pygame.K_RIGHT] or 'RIGHT' in touch_keys
-        is_up    = keys[pygame.K_UP] or 'UP' in touch_keys
-        is_down  = keys[pygame.K_DOWN] or 'DOWN' in touch_keys
+        if controls is None:
+            # The replay ran out mid-level (a race stopped by its time limit): freeze it there
+            if self.game_state == "PLAYING":
+                self.final_time_str = self.get_time_string()
+                self.game_state = "REPLAY_END"
+            return None
 
         if self.game_state == "START_MENU":
-            if is_action:
-                self.game_state = "PLAYING"
-                self.current_level_index = 0
-                self.detentions = 0
-                self.start_ticks = pygame.time.get_ticks()
-                self.load_level(0)
-            return
+            if controls.action: self.start_run(self.playback.replay.mode if self.playback else 'campaign')
+            return None
 
         if current_time - self.state_timer > 1000:
-            if (self.game_state == "GAME_OVER" or self.game_state == "VICTORY") and is_action:
+            if (self.game_state == "GAME_OVER" or self.game_state == "VICTORY") and controls.action:
                 self.game_state = "START_MENU"
-                return
-            if self.game_state == "LEVEL_COMPLETE" and is_action:
+                return None
+            if self.game_state == "LEVEL_COMPLETE" and controls.action:
                 self.game_state = "PLAYING"
                 self.current_level_index += 1
                 self.load_level(self.current_level_index)
-                return
+                return None
 
-        if self.game_state != "PLAYING": return
+        return controls
 
-        delay = self.sprint_delay if is_shift else self.walk_delay
-        if current_time - self.move_timer > delay:
-            dx, dy = 0, 0
-            if is_left: dx = -TILE_SIZE
-            elif is_right: dx = TILE_SIZE
-            elif is_up: dy = -TILE_SIZE
-            elif is_down: dy = TILE_SIZE
-            if dx or dy:
-                self.player.move(dx, dy, self.walls)
-                self.move_timer = current_time
-
-    def update(self):
+    def process_events(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                if self.profile_trace: self.profiler.dump(self.profile_trace)
                 pygame.quit()
                 sys.exit()
+            if self.playback and event.type == pygame.KEYDOWN and event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                offset = REPLAY_SEEK_STEPS if event.key == pygame.K_RIGHT else -REPLAY_SEEK_STEPS
+                self.seek_replay(self.playback.cursor + offset)
+            if self.game_state == "START_MENU" and not self.playback and event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_e: self.start_run('endless')
+                elif event.key == pygame.K_d: self.start_run('daily')
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.enabled = not self.profiler.enabled
+                self.full_redraw = True
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4 and self.profiler.count:
+                self.profiler.dump(time.strftime("profile-%Y%m%d-%H%M%S.csv"))
+            self.touch_controls.handle_event(event)
+            self.keyboard.handle_event(event)
+
+    def update(self):
+        controls = self.handle_input()
+        self.profiler.lap('input')
         
-        self.handle_input()
-        
-        if self.game_state == "PLAYING":
-            for enemy in self.enemies: enemy.update(self.walls)
-            self.check_interactions()
+        if self.game_state == "PLAYING" and controls:
+            self.replay.record(controls)
+            for event in self.sim.step(controls): self.on_sim_event(event)
         
         if self.game_state == "VICTORY":
-            self.update_confetti()
+            self.confetti.update()
+        self.profiler.lap('sim')
 
-    def check_interactions(self):
-        player_rect = self.player.rect
-        for paper in self.homework_items[:]: 
-            if player_rect.colliderect(paper):
-                self.homework_items.remove(paper)
-                self.score += 1
-                self.message = f"Homework Collected: {self.score}/{self.total_homework}"
-        
-        for enemy in self.enemies:
-            if player_rect.colliderect(enemy.rect.inflate(-10, -10)):
-                self.lives -= 1
-                self.detentions += 1
-                if self.lives > 0:
-                    self.player.rect.topleft = self.start_pos
-                    self.message = f"Caught! Chances: {self.lives}"
-                else:
-                    self.final_time_str = self.get_time_string()
-                    self.game_state = "GAME_OVER"
-                    self.state_timer = pygame.time.get_ticks()
+    def on_sim_event(self, event):
+        if event == 'caught' or event == 'game_over':
+            self.detentions += 1
+        if event == 'game_over':
+            self.final_time_str = self.get_time_string()
+            self.game_state = "GAME_OVER"
+            self.state_timer = pygame.time.get_ticks()
+            self.finish_replay()
+        elif event == 'cleared':
+            if self.levels.is_last(self.current_level_index):
+                self.final_time_str = self.get_time_string()
+                self.game_state = "VICTORY"
+                self.create_confetti()
+                self.state_timer = pygame.time.get_ticks()
+                self.finish_replay()
+            else:
+                self.game_state = "LEVEL_COMPLETE"
+                self.state_timer = pygame.time.get_ticks()
+
+    def finish_replay(self):
+        self.replay.outcome = self.game_state
+        self.replay.detentions = self.detentions
+        if self.playback or not SAVE_REPLAYS: return
+        try:
+            os.makedirs(REPLAY_DIR, exist_ok=True)
+            self.replay.save(os.path.join(REPLAY_DIR, time.strftime("run-%Y%m%d-%H%M%S.json")))
+        except OSError: pass
+
+    def seek_replay(self, step):
+        # Jump the playback to `step` (clamped to the recording) from the nearest snapshot
+        runner = self.playback.runner
+        runner.seek(max(0, min(step, self.playback.replay.steps - 1)))
+        self.sim = runner.sim
+        self.sim.profiler = self.profiler
+        self.rng.setstate(runner.rng.getstate())
+        self.current_level_index = runner.level_index
+        self.detentions = runner.catches + self.sim.catches
+        self.playback.cursor = runner.step
+        self.game_state = "PLAYING"
+        self.full_redraw = True
+
+    def get_arrow_line(self):
+        if not self.sim.homework: return None
+        px, py = self.sim.player.rect.center
+        # Point along the walking route to the nearest homework, not straight through walls
+        step = self.sim.homework_field.next_step(px // TILE_SIZE, py // TILE_SIZE)
+        if step:
+            tx, ty = step[0] * TILE_SIZE + TILE_SIZE // 2, step[1] * TILE_SIZE + TILE_SIZE // 2
+        else:
+            closest = min(self.sim.homework.values(), key=lambda i: math.hypot(i.centerx-px, i.centery-py))
+            tx, ty = closest.center
+        angle = math.atan2(ty - py, tx - px)
+        return (px, py), (px + math.cos(angle)*30, py + math.sin(angle)*30)
+
+    def get_scene(self):
+        # Everything drawn over the map as (kind, arrow line, screen rect), culled to the camera
+        cam = self.camera
+        ox, oy = -cam.x, -cam.y
+        scene = []
+
+        # Homework is blitted as a full tile-sized sprite at its 20x20 pickup rect
+        hw_size = self.assets['homework'].get_size() if self.assets['homework'] else (20, 20)
+        homework = self.sim.homework
+        c0, c1, r0, r1 = tile_span(cam)
+        c0, r0 = c0 - 1, r0 - 1  # sprites hang over into the next tile
+        if len(homework) > (c1 - c0 + 1) * (r1 - r0 + 1):
+            papers = [homework[t] for t in ((c, r) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)) if t in homework]
+        else:
+            papers = homework.values()
+        for paper in papers:
+            rect = pygame.Rect(paper.topleft, hw_size)
+            if cam.colliderect(rect): scene.append(('homework', None, rect.move(ox, oy)))
+
+        for rect in self.sim.enemies.draw_rects(cam, self.render_alpha):
+            scene.append(('enemy', None, rect.move(ox, oy)))
+
+        scene.append(('player', None, self.sim.player.rect.move(ox, oy)))
+
+        arrow = self.get_arrow_line()
+        if arrow:
+            (x1, y1), (x2, y2) = arrow
+            x1, y1, x2, y2 = x1 + ox, y1 + oy, x2 + ox, y2 + oy
+            rect = pygame.Rect(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1).inflate(10, 10)
+            scene.append(('arrow', ((x1, y1), (x2, y2)), rect))
+        return scene
+
+    def draw_sprite(self, kind, line, rect):
+        if kind == 'arrow':
+            pygame.draw.line(self.screen, GOLD, line[0], line[1], 4)
+            return
+        asset, color = SPRITE_STYLES[kind]
+        if self.assets[asset]: self.screen.blit(self.assets[asset], rect)
+        else: pygame.draw.rect(self.screen, color, rect)
+
+    def get_hud_surface(self):
+        # The top bar only changes when the message, timer or lives do
+        key = (self.sim.message, self.get_time_string(), self.sim.lives, self.assets_version)
+        if self.hud_surface is not None and self.hud_key == key:
+            return self.hud_surface
+
+        hud = pygame.Surface((SCREEN_WIDTH, HUD_HEIGHT), pygame.SRCALPHA)
+        hud.fill((0, 0, 0, 180))
         
-        for goal in self.goals:
-            if player_rect.colliderect(goal):
-                if self.score == self.total_homework:
-                    if self.current_level_index == len(ALL_LEVELS) - 1:
-                        self.final_time_str = self.get_time_string()
-                        self.game_state = "VICTORY"
-                        self.create_confetti()
-                        self.state_timer = pygame.time.get_ticks()
-                    else:
-                        self.game_state = "LEVEL_COMPLETE"
-                        self.state_timer = pygame.time.get_ticks()
-                else: 
-                    self.message = f"Locked! Need {self.total_homework - self.score} more papers."
+        # Lives
+        for i in range(self.sim.lives):
+            h_x = 10 + (i * 30)
+            if self.assets['heart']: hud.blit(self.assets['heart'], (h_x, 8))
+            else: pygame.draw.circle(hud, HEART_RED, (h_x + 10, 20), 8)
+
+        # Center Message
+        msg_width = self.hud_glyphs.width(self.sim.message)
+        self.hud_glyphs.draw(hud, self.sim.message, (SCREEN_WIDTH//2 - msg_width//2, 10))
+
+        # Timer
+        timer_str = f"Time: {key[1]}"
+        self.hud_glyphs.draw(hud, timer_str, (SCREEN_WIDTH - self.hud_glyphs.width(timer_str) - 10, 10))
+
+        self.hud_surface, self.hud_key = hud, key
+        return hud
+
+    def draw_dirty(self):
+        # Partial-update renderer for PLAYING: only the regions that changed since the
+        # last frame are restored from the map chunks, redrawn and pushed to the display
+        camera = self.camera.topleft
+        self.update_camera()
+        if self.camera.topleft != camera: self.full_redraw = True
+
+        scene = self.get_scene()
+        rects = [rect for _, _, rect in scene]
+        hud_key = self.hud_key
+        hud = self.get_hud_surface()
+        frame = {tuple(r) for r in rects}
+
+        if self.full_redraw:
+            self.screen.fill(BLACK)
+            self.draw_level()
+            for sprite in scene: self.draw_sprite(*sprite)
+            self.screen.blit(hud, (0, 0))
+            self.touch_controls.draw(self.screen)
+            self.touch_controls.pop_changed_rects()
+            self.present()
+            self.full_redraw = False
+            self.dirty_prev_frame = frame
+            return
+
+        dirty = [pygame.Rect(r) for r in frame ^ self.dirty_prev_frame]
+        dirty += self.touch_controls.pop_changed_rects()
+        if hud_key != self.hud_key: dirty.append(pygame.Rect(0, 0, SCREEN_WIDTH, HUD_HEIGHT))
+        self.dirty_prev_frame = frame
+        if not dirty: return self.present(dirty)
+
+        # Grow the dirty set until every sprite touching it is fully inside it, and keep
+        # the rects disjoint so translucent layers are only blended once per pixel
+        drawn = set()
+        while True:
+            dirty = merge_rects(dirty)
+            grew = False
+            for i, r in enumerate(rects):
+                if i not in drawn and r.collidelist(dirty) != -1:
+                    drawn.add(i)
+                    dirty.append(r.copy())
+                    grew = True
+            if not grew: break
+
+        for r in dirty:
+            self.screen.fill(BLACK, r)
+            self.draw_level(r)
+        for i in sorted(drawn): self.draw_sprite(*scene[i])
+        for r in dirty:
+            if r.colliderect(hud.get_rect()): self.screen.blit(hud, r, r)
+        self.touch_controls.draw(self.screen, dirty)
+        self.present(dirty)
+
+    def set_render_scale(self, scale):
+        # The browser canvas is resized to match; a desktop window keeps the size it was opened at
+        size = (round(SCREEN_WIDTH * scale), round(SCREEN_HEIGHT * scale))
+        self.render_scale = scale
+        if self.display is None or sys.platform == 'emscripten': self.display = pygame.display.set_mode(size)
+        size = self.display.get_size()
+        if size == (SCREEN_WIDTH, SCREEN_HEIGHT): self.screen = self.display
+        elif self.screen is None or self.screen is self.display:
+            self.screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        self.touch_controls.pointer_scale = size[0] / SCREEN_WIDTH
+        self.full_redraw = True
+
+    def present(self, rects=None):
+        # Push the finished frame to the display (only `rects` if given), with the profiler on top
+        if self.profiler.enabled:
+            overlay = self.get_profile_surface()
+            pos = (SCREEN_WIDTH - overlay.get_width() - 5, HUD_HEIGHT + 5)
+            self.screen.blit(overlay, pos)
+            if rects is not None: rects = rects + [overlay.get_rect(topleft=pos)]
+        self.profiler.lap('draw')
+        if self.screen is not self.display and (rects is None or rects):
+            # One scale of the whole frame: nearest-neighbour keeps whole-number HiDPI upscales crisp,
+            # while other scales are filtered so thin lines and HUD text don't drop out
+            size = self.display.get_size()
+            if size[0] % SCREEN_WIDTH == 0 and size[1] % SCREEN_HEIGHT == 0: pygame.transform.scale(self.screen, size, self.display)
+            else: pygame.transform.smoothscale(self.screen, size, self.display)
+            rects = None
+        if rects is None: pygame.display.flip()
+        elif rects: pygame.display.update(rects)
+        self.profiler.lap('flip')
+
+    def get_profile_surface(self):
+        # Frame-time percentiles, mean time per phase and a graph of recent frame times.
+        # Rebuilt every PROFILE_OVERLAY_REFRESH frames rather than every frame.
+        key = self.profiler.count // PROFILE_OVERLAY_REFRESH
+        if self.profile_surface is not None and self.profile_key == key:
+            return self.profile_surface
+
+        glyphs = self.profile_glyphs
+        line = glyphs.height
+        graph_h = 50
+        surface = pygame.Surface((PROFILE_GRAPH_FRAMES + 10, line * (len(FrameProfiler.PHASES) + 1) + graph_h + 15))
+        surface.fill(BLACK)
+        pygame.draw.rect(surface, GATOR_GREEN, surface.get_rect(), 1)
+
+        stats = self.profiler.summary(PROFILE_GRAPH_FRAMES)
+        if stats:
+            glyphs.draw(surface, f"p50 {stats['p50']:.1f}  p95 {stats['p95']:.1f}  p99 {stats['p99']:.1f} ms", (5, 4))
+            for i, (phase, ms) in enumerate(stats['phases'].items()):
+                y = 4 + line * (i + 1)
+                glyphs.draw(surface, phase, (5, y))
+                value = f"{ms:.2f} ms"
+                glyphs.draw(surface, value, (surface.get_width() - 5 - glyphs.width(value), y))
+
+            # One point per frame; the gold line is the 1/FPS frame budget and the top is twice that
+            budget = 1.0 / FPS
+            bottom = surface.get_height() - 6
+            rows = self.profiler.recorded(PROFILE_GRAPH_FRAMES)
+            points = [(5 + i, bottom - min(graph_h, int(sum(row) / budget * graph_h / 2))) for i, row in enumerate(rows)]
+            pygame.draw.line(surface, GOLD, (5, bottom - graph_h // 2), (5 + PROFILE_GRAPH_FRAMES, bottom - graph_h // 2))
+            if len(points) > 1: pygame.draw.lines(surface, GATOR_GREEN, False, points)
+        else:
+            glyphs.draw(surface, "Profiling...", (5, 4))
+
+        self.profile_surface, self.profile_key = surface, key
+        return surface
 
     def draw(self):
+        if self.dirty_rendering and self.game_state == "PLAYING":
+            self.draw_dirty()
+            return
+        self.full_redraw = True
+        self.touch_controls.pop_changed_rects()
+
         self.screen.fill(BLACK)
         
         if self.game_state == "START_MENU":
@@ -377,80 +1150,39 @@ class Game:
                 for y in range(0, SCREEN_HEIGHT, TILE_SIZE*2):
                     pygame.draw.rect(self.screen, (20, 20, 35), (x, y, TILE_SIZE, TILE_SIZE))
 
-            t1 = self.title_font.render("COMPASS HIGH", True, GATOR_GREEN)
-            t2 = self.big_font.render("Ivan's Journey", True, WHITE)
+            t1 = self.text_cache.render(self.title_font, "COMPASS HIGH", GATOR_GREEN)
+            t2 = self.text_cache.render(self.big_font, "Ivan's Journey", WHITE)
             alpha = (math.sin(pygame.time.get_ticks() / 300) + 1) * 127
             
-            t3 = self.font.render("Press ENTER or Tap GO to Start", True, (255, 255, 255))
-            t3.set_alpha(int(alpha))
+            t3 = self.text_cache.render(self.font, "Press ENTER or Tap GO to Start", (255, 255, 255))
+            t4 = self.text_cache.render(self.font, "E: Endless    D: Daily Challenge", (200, 200, 200))
 
             self.screen.blit(t1, (SCREEN_WIDTH//2 - t1.get_width()//2, 150))
             self.screen.blit(t2, (SCREEN_WIDTH//2 - t2.get_width()//2, 230))
+            # t3 is shared with the text cache, so undo the fade once it has been drawn
+            t3.set_alpha(int(alpha))
             self.screen.blit(t3, (SCREEN_WIDTH//2 - t3.get_width()//2, 400))
+            t3.set_alpha(255)
+            self.screen.blit(t4, (SCREEN_WIDTH//2 - t4.get_width()//2, 430))
             
             if self.assets['player']:
                 big_ivan = pygame.transform.scale(self.assets['player'], (80, 80))
                 self.screen.blit(big_ivan, (SCREEN_WIDTH//2 - 40, 300))
                 
             self.touch_controls.draw(self.screen)
-            pygame.display.flip()
+            self.present()
             return
 
-        if self.game_state in ["PLAYING", "LEVEL_COMPLETE"]:
-            # Draw Map
-            for r, row in enumerate(ALL_LEVELS[self.current_level_index]):
-                for c, tile in enumerate(row):
-                    x, y = c * TILE_SIZE, r * TILE_SIZE
-                    if self.assets['floor']: self.screen.blit(self.assets['floor'], (x, y))
-                    else: pygame.draw.rect(self.screen, FLOOR_BLUE, (x, y, TILE_SIZE, TILE_SIZE))
-                    
-                    if tile == 'W': 
-                        if self.assets['wall']: self.screen.blit(self.assets['wall'], (x, y))
-                        else: pygame.draw.rect(self.screen, WALL_GREY, (x, y, TILE_SIZE, TILE_SIZE))
-                    elif tile == 'D':
-                        if self.assets['desk']: self.screen.blit(self.assets['desk'], (x, y))
-                        else: pygame.draw.rect(self.screen, WOOD_BROWN, (x, y, TILE_SIZE, TILE_SIZE))
-                    elif tile == 'O': 
-                        if self.assets['door']: self.screen.blit(self.assets['door'], (x, y))
-                        else: pygame.draw.rect(self.screen, (200, 50, 50), (x, y, TILE_SIZE, TILE_SIZE))
-            
-            # Draw Items & Entities
-            for paper in self.homework_items:
-                if self.assets['homework']: self.screen.blit(self.assets['homework'], paper)
-                else: pygame.draw.rect(self.screen, WHITE, paper)
-            
-            for enemy in self.enemies:
-                if self.assets['enemy']: self.screen.blit(self.assets['enemy'], enemy.rect)
-                else: pygame.draw.rect(self.screen, RED, enemy.rect)
+        if self.game_state in ["PLAYING", "LEVEL_COMPLETE", "REPLAY_END"]:
+            # Draw Map (only the pre-baked chunks the camera can see)
+            self.update_camera()
+            self.draw_level()
             
-            if self.assets['player']: self.screen.blit(self.assets['player'], self.player.rect)
-            else: pygame.draw.rect(self.screen, GATOR_GREEN, self.player.rect)
-            
-            # Draw Direction Arrow
-            if self.homework_items:
-                px, py = self.player.rect.center
-                closest = min(self.homework_items, key=lambda i: math.hypot(i.centerx-px, i.centery-py))
-                angle = math.atan2(closest.centery - py, closest.centerx - px)
-                pygame.draw.line(self.screen, GOLD, (px, py), (px + math.cos(angle)*30, py + math.sin(angle)*30), 4)
+            # Draw Items, Entities & Direction Arrow
+            for sprite in self.get_scene(): self.draw_sprite(*sprite)
 
             # --- HUD (TOP BAR) ---
-            hud_bg = pygame.Surface((SCREEN_WIDTH, 40), pygame.SRCALPHA)
-            hud_bg.fill((0, 0, 0, 180))
-            self.screen.blit(hud_bg, (0,0))
-            
-            # Lives
-            for i in range(self.lives):
-                h_x = 10 + (i * 30)
-                if self.assets['heart']: self.screen.blit(self.assets['heart'], (h_x, 8))
-                else: pygame.draw.circle(self.screen, HEART_RED, (h_x + 10, 20), 8)
-
-            # Center Message
-            msg_text = self.font.render(self.message, True, WHITE)
-            self.screen.blit(msg_text, (SCREEN_WIDTH//2 - msg_text.get_width()//2, 10))
-
-            # Timer
-            timer_text = self.font.render(f"Time: {self.get_time_string()}", True, WHITE)
-            self.screen.blit(timer_text, (SCREEN_WIDTH - timer_text.get_width() - 10, 10))
+            self.screen.blit(self.get_hud_surface(), (0, 0))
 
             self.touch_controls.draw(self.screen)
 
@@ -458,18 +1190,28 @@ class Game:
             overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
             overlay.fill((0, 0, 0, 180))
             self.screen.blit(overlay, (0,0))
-            t1 = self.big_font.render("LEVEL COMPLETE!", True, GOLD)
-            t2 = self.font.render("Press ENTER or Tap GO to Continue", True, WHITE)
+            t1 = self.text_cache.render(self.big_font, "LEVEL COMPLETE!", GOLD)
+            t2 = self.text_cache.render(self.font, "Press ENTER or Tap GO to Continue", WHITE)
             self.screen.blit(t1, (SCREEN_WIDTH//2 - t1.get_width()//2, SCREEN_HEIGHT//2 - 50))
             self.screen.blit(t2, (SCREEN_WIDTH//2 - t2.get_width()//2, SCREEN_HEIGHT//2 + 10))
             self.touch_controls.draw(self.screen)
             
+        if self.game_state == "REPLAY_END":
+            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+            overlay.fill((0, 0, 0, 180))
+            self.screen.blit(overlay, (0,0))
+            t1 = self.text_cache.render(self.big_font, "END OF REPLAY", WHITE)
+            t2 = self.text_cache.render(self.font, "Left/Right to Seek", (200, 200, 200))
+            self.screen.blit(t1, (SCREEN_WIDTH//2 - t1.get_width()//2, SCREEN_HEIGHT//2 - 50))
+            self.screen.blit(t2, (SCREEN_WIDTH//2 - t2.get_width()//2, SCREEN_HEIGHT//2 + 10))
+
         if self.game_state == "GAME_OVER":
             self.screen.fill(BLACK) 
-            t1 = self.big_font.render("SUMMER SCHOOL!", True, RED)
+            t1 = self.text_cache.render(self.big_font, "SUMMER SCHOOL!", RED)
             stats = f"Time: {self.final_time_str} | Detentions: {self.detentions}"
-            t2 = self.font.render(stats, True, WHITE)
-            t3 = self.font.render("Press ENTER or Tap GO to Restart", True, (200, 200, 200))
+            if self.mode == 'endless': stats += f" | Levels Cleared: {self.current_level_index}"
+            t2 = self.text_cache.render(self.font, stats, WHITE)
+            t3 = self.text_cache.render(self.font, "Press ENTER or Tap GO to Restart", (200, 200, 200))
             self.screen.blit(t1, (SCREEN_WIDTH//2 - t1.get_width()//2, SCREEN_HEIGHT//2 - 60))
             self.screen.blit(t2, (SCREEN_WIDTH//2 - t2.get_width()//2, SCREEN_HEIGHT//2 + 10))
             self.screen.blit(t3, (SCREEN_WIDTH//2 - t3.get_width()//2, SCREEN_HEIGHT//2 + 50))
@@ -477,22 +1219,17 @@ class Game:
 
         if self.game_state == "VICTORY":
             self.screen.fill(DARK_GREEN)
-            for p in self.confetti:
-                if p['type'] == 'compass' and self.assets['compass']:
-                    scaled = pygame.transform.scale(self.assets['compass'], (p['size']*2, p['size']*2))
-                    self.screen.blit(scaled, (p['x'], p['y']))
-                else:
-                    pygame.draw.rect(self.screen, p['color'], (p['x'], p['y'], p['size'], p['size']))
+            self.confetti.draw(self.screen)
             
-            t1 = self.title_font.render("YOU GRADUATED!", True, GOLD)
-            t1_s = self.title_font.render("YOU GRADUATED!", True, BLACK)
+            t1 = self.text_cache.render(self.title_font, "YOU GRADUATED!", GOLD)
+            t1_s = self.text_cache.render(self.title_font, "YOU GRADUATED!", BLACK)
             title_y = SCREEN_HEIGHT // 2 - 130
             self.screen.blit(t1_s, (SCREEN_WIDTH//2 - t1.get_width()//2 + 3, title_y + 3))
             self.screen.blit(t1, (SCREEN_WIDTH//2 - t1.get_width()//2, title_y))
             
             stats = f"Final Time: {self.final_time_str} | Detentions: {self.detentions}"
-            t2 = self.font.render(stats, True, WHITE)
-            t3 = self.font.render("Press ENTER or Tap GO to Return", True, (200, 200, 200))
+            t2 = self.text_cache.render(self.font, stats, WHITE)
+            t3 = self.text_cache.render(self.font, "Press ENTER or Tap GO to Return", (200, 200, 200))
             
             box_y = SCREEN_HEIGHT // 2
             pygame.draw.rect(self.screen, BLACK, (SCREEN_WIDTH//2 - 200, box_y, 400, 80))
@@ -502,50 +1239,799 @@ class Game:
             self.screen.blit(t3, (SCREEN_WIDTH//2 - t3.get_width()//2, box_y + 50))
             self.touch_controls.draw(self.screen)
         
-        pygame.display.flip()
+        self.present()
 
     async def run(self):
+        # Fixed-timestep loop: the simulation advances in SIM_RATE steps per second no matter
+        # how fast frames are drawn, and enemies are interpolated between the last two steps
+        step = 1.0 / SIM_RATE
+        accumulator = 0.0
+        previous = time.perf_counter()
+        self.asset_loader = asyncio.create_task(self.load_images())
+        self.level_prefetcher = asyncio.create_task(self.prefetch_levels())
         while True:
-            self.update()
+            frame_start = time.perf_counter()
+            frame_time = frame_start - previous
+            accumulator += frame_time
+            previous = frame_start
+            self.profiler.start_frame(frame_start)
+
+            self.process_events()
+            self.profiler.lap('events')
+            steps = 0
+            while accumulator >= step and steps < MAX_STEPS_PER_FRAME:
+                self.update()
+                accumulator -= step
+                steps += 1
+            # After a long stall (e.g. a backgrounded tab) drop the backlog instead of fast-forwarding
+            if accumulator >= step: accumulator %= step
+
+            self.render_alpha = accumulator / step
             self.draw()
-            await asyncio.sleep(0)
+            if self.scaler and self.scaler.update(frame_time, time.perf_counter() - frame_start):
+                self.set_render_scale(self.scaler.scale)
+
+            # Sleep off whatever is left of the frame budget so we don't spin the CPU
+            remaining = 1.0 / FPS - (time.perf_counter() - frame_start)
+            await asyncio.sleep(max(0.0, remaining))
+            self.profiler.lap('idle')
+            self.profiler.end_frame()
+
+# --- LEVELS ---
+# A level is parsed once into a CompiledLevel (solid grid, spawn lists, enemy definitions and the
+# initial homework distance field), which every Simulation of that level shares read-only.
+TILE_KINDS = set("WDPOHER.")
+
+class CompiledLevel:
+    def __init__(self, tiles, name=None):
+        self.name = name
+        self.tiles = tuple(tiles)
+        label = name or "level"
+        if not self.tiles: raise ValueError(f"{label}: map is empty")
+        self.cols, self.rows = len(self.tiles[0]), len(self.tiles)
+        
+        solid = SolidGrid(self.cols, self.rows)
+        starts, goals, homework, enemies = [], [], [], []
+        for r, row in enumerate(self.tiles):
+            if len(row) != self.cols: raise ValueError(f"{label}: row {r} is {len(row)} tiles wide, expected {self.cols}")
+            for c, tile in enumerate(row):
+                if tile not in TILE_KINDS: raise ValueError(f"{label}: unknown tile {tile!r} at row {r}, column {c}")
+                if tile == 'W' or tile == 'D': solid.set_solid(c, r)
+                elif tile == 'P': starts.append((c, r))
+                elif tile == 'O': goals.append((c, r))
+                elif tile == 'H': homework.append((c, r))
+                elif tile == 'E': enemies.append((c, r, 'vertical'))
+                elif tile == 'R': enemies.append((c, r, 'horizontal'))
+        if len(starts) != 1: raise ValueError(f"{label}: needs exactly one 'P' start, found {len(starts)}")
+        if not goals: raise ValueError(f"{label}: needs at least one 'O' goal")
+        
+        solid.cells = bytes(solid.cells)  # frozen: shared by every run of this level
+        self.solid_grid = solid
+        self.player_start = starts[0]
+        self.goals, self.homework, self.enemies = tuple(goals), tuple(homework), tuple(enemies)
+        self.homework_field = DistanceField(solid, self.homework)
+        self.goal_distances = None
+        # Identifies this exact layout in replays
+        self.fingerprint = hashlib.sha1("\n".join(self.tiles).encode()).hexdigest()[:16]
+
+    @property
+    def goal_field(self):
+        # Walking distance to the nearest goal, built the first time a bot or the par solver needs it
+        if self.goal_distances is None: self.goal_distances = DistanceField(self.solid_grid, self.goals)
+        return self.goal_distances
+
+def load_level_file(path):
+    # Level files are JSON: {"name": "Library", "map": ["WWWW...", "W.P.", ...]}
+    with open(path, encoding='utf-8') as f:
+        try: data = json.load(f)
+        except ValueError as e: raise ValueError(f"{path}: {e}") from None
+    if not isinstance(data, dict) or not isinstance(data.get('map'), list): raise ValueError(f"{path}: needs a \"map\" list of rows")
+    name = data.get('name') or os.path.splitext(os.path.basename(path))[0]
+    return CompiledLevel(data['map'], name)
+
+class LevelSource:
+    # Levels by index, compiled the first time they are played and kept in a small LRU cache.
+    # Subclasses compile level i and set count (None when the levels never run out).
+    count = None
+
+    def __init__(self):
+        self.compiled = OrderedDict()
+        self.failed = set()  # Levels that would not compile, already reported
+
+    def compile(self, index): raise NotImplementedError
+
+    def try_get(self, index):
+        # The level, or None if it doesn't compile (a broken levels/*.json), reported just once
+        if index in self.failed: return None
+        try: return self.get(index)
+        except Exception as e:
+            print(f"Skipping level {index + 1}: {e}", file=sys.stderr)
+            self.failed.add(index)
+            return None
+
+    def playable(self, index):
+        # (index, level) of the first level from `index` on that compiles, or None if there are
+        # none left. The game, replays and races all load through here, so they skip the same ones.
+        while self.count is None or index < self.count:
+            level = self.try_get(index)
+            if level: return index, level
+            index += 1
+        return None
+
+    def is_last(self, index): return self.playable(index + 1) is None
+
+    def get(self, index):
+        level = self.compiled.get(index)
+        if level is None:
+            level = self.compile(index)
+            self.compiled[index] = level
+            if len(self.compiled) > LEVEL_CACHE_SIZE: self.compiled.popitem(last=False)
+        else:
+            self.compiled.move_to_end(index)
+        return level
+
+    def prefetch(self, start, count):
+        # Compiles the first missing level of start..start+count-1; False if they are all ready
+        end = start + count if self.count is None else min(start + count, self.count)
+        for index in range(start, end):
+            if index not in self.compiled and index not in self.failed:
+                self.try_get(index)
+                return True
+        return False
+
+class LevelLibrary(LevelSource):
+    # The campaign: the built-in ALL_LEVELS, then every levels/*.json file in filename order.
+    # Files are only read and compiled when a level is first played.
+    def __init__(self, builtin=ALL_LEVELS, directory=LEVEL_DIR):
+        super().__init__()
+        self.sources = list(builtin)
+        if os.path.isdir(directory):
+            self.sources += [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.json')]
+        self.count = len(self.sources)
+
+    def __len__(self): return len(self.sources)
+
+    def compile(self, index):
+        source = self.sources[index]
+        return load_level_file(source) if isinstance(source, str) else CompiledLevel(source)
+
+# --- LEVEL GENERATOR ---
+# Endless and daily-challenge levels are generated rather than hand-written. Candidates are
+# validated with bitboards: a set of tiles is a Python int with bit row * cols + col set for
+# each tile, so growing a flood fill by one tile in every direction is four shifts and a mask.
+class LevelGenerator:
+    def __init__(self, cols, rows):
+        self.cols, self.rows = cols, rows
+        every = (1 << cols * rows) - 1
+        first_col = sum(1 << r * cols for r in range(rows))
+        # Masks that stop horizontal shifts from wrapping onto the next or previous row
+        self.not_first_col, self.not_last_col = every & ~first_col, every & ~(first_col << cols - 1)
+        self.border = first_col | first_col << cols - 1 | (1 << cols) - 1 | ((1 << cols) - 1) << (rows - 1) * cols
+
+    def grow(self, tiles):
+        # tiles plus every tile next to one of them
+        cols = self.cols
+        return (tiles | (tiles << 1 & self.not_first_col) | (tiles >> 1 & self.not_last_col)
+                | tiles << cols | tiles >> cols) & ((1 << cols * self.rows) - 1)
+
+    def reachable(self, open_tiles, start):
+        reach = start
+        while True:
+            grown = self.grow(reach) & open_tiles
+            if grown == reach: return reach
+            reach = grown
+
+    def valid(self, solid, start, homework, goals, vertical, horizontal):
+        # Every paper and at least one goal can be walked to, and every hall monitor has room
+        # to move along its axis (one boxed in on both sides would just jitter in place)
+        open_tiles = ~solid & ((1 << self.cols * self.rows) - 1)
+        reach = self.reachable(open_tiles, start)
+        if reach & homework != homework or not reach & goals: return False
+        cols = self.cols
+        if vertical & ~(open_tiles << cols | open_tiles >> cols): return False
+        if horizontal & ~((open_tiles << 1 & self.not_first_col) | (open_tiles >> 1 & self.not_last_col)): return False
+
+        # A monitor pacing a corridor with no side openings between its two ends can't be got
+        # past: whoever goes in at one end meets it before coming out of the other. So every
+        # paper and a goal must still be reachable with the corridor open at only one end.
+        for patrols, step, side in ((vertical, cols, 1), (horizontal, 1, cols)):
+            while patrols:
+                low = patrols & -patrols
+                patrols ^= low
+                lo = hi = low.bit_length() - 1
+                while open_tiles >> lo - step & 1: lo -= step
+                while open_tiles >> hi + step & 1: hi += step
+                inner = sum(1 << i for i in range(lo + step, hi, step))
+                if inner & (start | open_tiles << side | open_tiles >> side): continue
+                rest = open_tiles & ~inner & ~(1 << lo | 1 << hi)
+                # Papers or a goal inside the corridor can be fetched from either end
+                either = self.reachable(rest | 1 << lo, start) | self.reachable(rest | 1 << hi, start) | inner
+                if either & homework != homework or not either & goals: return False
+        return True
+
+    def candidate(self, rng, homework, enemies):
+        # Random wall runs and desk blocks, then the player, papers, a goal and patrols on the floor
+        cols, rows = self.cols, self.rows
+        walls = self.border
+        for _ in range(cols * rows // 25):
+            c, r, length = rng.randrange(1, cols - 1), rng.randrange(1, rows - 1), rng.randrange(2, 6)
+            if rng.random() < 0.5: walls |= sum(1 << r * cols + min(c + i, cols - 2) for i in range(length))
+            else: walls |= sum(1 << min(r + i, rows - 2) * cols + c for i in range(length))
+        desks = 0
+        for _ in range(cols * rows // 60):
+            c, r = rng.randrange(1, cols - 2), rng.randrange(1, rows - 2)
+            desks |= (3 << r * cols + c | 3 << (r + 1) * cols + c) & ~walls
+        solid = walls | desks
+
+        # Bit i of the int is character i of its reversed binary string
+        floor = [i for i, bit in enumerate(format(solid, f'0{cols * rows}b')[::-1]) if bit == '0']
+        if len(floor) < 2 + homework + enemies: return None
+        picks = rng.sample(floor, 2 + homework + enemies)
+        start, goal = 1 << picks[0], 1 << picks[1]
+        papers = sum(1 << i for i in picks[2:2 + homework])
+        # Patrols never spawn within two tiles of the player
+        near = self.grow(self.grow(start))
+        spawns = [i for i in picks[2 + homework:] if not near >> i & 1]
+        vertical = sum(1 << i for i in spawns[::2])
+        horizontal = sum(1 << i for i in spawns[1::2])
+        if not self.valid(solid, start, papers, goal, vertical, horizontal): return None
+
+        tiles = {'W': walls, 'D': desks, 'P': start, 'O': goal, 'H': papers, 'E': vertical, 'R': horizontal}
+        grid = bytearray(b'.' * (cols * rows))
+        for ch, bits in tiles.items():
+            while bits:
+                low = bits & -bits
+                grid[low.bit_length() - 1] = ord(ch)
+                bits ^= low
+        return [grid[r * cols:(r + 1) * cols].decode() for r in range(rows)]
+
+    def generate(self, rng, homework, enemies):
+        # Keeps drawing candidates until one passes; with these densities most do
+        while True:
+            level = self.candidate(rng, homework, enemies)
+            if level: return level
+
+def generated_size(index):
+    # Endless levels start at the campaign's 20x11 and grow every third level
+    return min(20 + 2 * (index // 3), 40), min(11 + index // 3, 21)
+
+class GeneratedLevels(LevelSource):
+    # Level source for the endless and daily modes. Level i comes from its own rng seeded with
+    # (seed, i), so a run can be rebuilt from its seed alone, and each level gets bigger and
+    # busier than the last. count is None for endless.
+    def __init__(self, seed, count=None):
+        super().__init__()
+        self.seed, self.count = seed, count
+        self.generators = {}
+
+    def compile(self, index):
+        size = generated_size(index)
+        if size not in self.generators: self.generators[size] = LevelGenerator(*size)
+        rng = random.Random(f"{self.seed}-{index}")
+        tiles = self.generators[size].generate(rng, min(3 + index // 2, 12), min(2 + index, 16))
+        return CompiledLevel(tiles, f"Level {index + 1}")
+
+def daily_seed():
+    # Everyone playing on the same (local) date gets the same levels and hall monitor speeds
+    return int(time.strftime("%Y%m%d"))
+
+def level_source(mode, seed=None):
+    # Levels for a run: 'campaign' (ALL_LEVELS plus levels/*.json), 'endless' or 'daily'
+    if mode == 'campaign': return LevelLibrary()
+    return GeneratedLevels(seed, DAILY_LEVELS if mode == 'daily' else None)
+
+def new_run(mode, seed=None, level_seed=None, levels=None):
+    # (seed, level_seed, levels) for a run. Seeds not given are fresh random ones, or the date's
+    # for the daily challenge, so the whole run can be replayed from them and its inputs. The
+    # campaign has no level seed; an existing LevelLibrary passed as `levels` is kept, along
+    # with the levels it has already compiled.
+    if mode == 'daily': fresh_seed = fresh_level_seed = daily_seed()
+    else: fresh_seed, fresh_level_seed = random.randrange(1 << 32), random.randrange(1 << 32)
+    if seed is None: seed = fresh_seed
+    if mode == 'campaign': level_seed = None
+    elif level_seed is None: level_seed = fresh_level_seed
+    if mode != 'campaign' or not isinstance(levels, LevelLibrary): levels = level_source(mode, level_seed)
+    return seed, level_seed, levels
+
+# --- SIMULATION ---
+# Everything needed to play a level without a window: no display, fonts or input polling.
+# Time advances in fixed steps of STEP_MS and all randomness comes from the given rng.
+class Simulation:
+    walk_delay = 150  # ms between moves
+    sprint_delay = 70
+
+    def __init__(self, level, rng=None, batch_enemies=None, profiler=None):
+        # Takes a CompiledLevel, or a raw map (list of strings) which is compiled on the spot.
+        # batch_enemies forces EnemySwarm (True, needs NumPy) or EnemyGroup (False); None picks by patrol size.
+        self.level = level if isinstance(level, CompiledLevel) else CompiledLevel(level)
+        self.level_map = self.level.tiles
+        self.batch_enemies = batch_enemies
+        self.profiler = profiler
+        self.rng = rng if rng is not None else random.Random()
+        self.load()
+
+    def load(self):
+        # (Re)start the level from its compiled form; nothing here looks at the map characters
+        level = self.level
+        self.lives = 3
+        self.score = 0
+        self.catches = 0
+        self.steps = 0
+        self.ticks = 0
+        self.move_timer = -self.walk_delay - 1
+        self.status = "PLAYING"
+        self.solid_grid = level.solid_grid
+        self.start_pos = (level.player_start[0] * TILE_SIZE, level.player_start[1] * TILE_SIZE)
+        self.player = Player(*self.start_pos)
+        
+        # Homework and goals are looked up by (col, row) tile instead of scanned
+        self.goals = {(c, r): pygame.Rect(c * TILE_SIZE, r * TILE_SIZE, TILE_SIZE, TILE_SIZE) for c, r in level.goals}
+        self.homework = {(c, r): pygame.Rect(c * TILE_SIZE + 10, r * TILE_SIZE + 10, 20, 20) for c, r in level.homework}
+        self.total_homework = len(self.homework)
+        self.homework_field = level.homework_field.copy()
+
+        # Big patrols are stepped as arrays when NumPy is available, small ones as Enemy objects
+        speeds = [self.rng.choice(ENEMY_SPEEDS) for _ in level.enemies]
+        batch = self.batch_enemies
+        if batch is None: batch = len(level.enemies) >= ENEMY_BATCH_MIN
+        batch = batch and np is not None
+        self.enemies = (EnemySwarm if batch else EnemyGroup)(level.enemies, speeds, self.solid_grid)
+        
+        self.message = f"Homework Collected: 0/{self.total_homework}"
+
+    SNAPSHOT_FIELDS = ('lives', 'score', 'catches', 'steps', 'ticks', 'move_timer', 'status', 'message')
+
+    def snapshot(self):
+        # Everything step() changes, copied so the snapshot can be restored more than once
+        state = {name: getattr(self, name) for name in self.SNAPSHOT_FIELDS}
+        state['player'] = self.player.rect.topleft
+        state['homework'] = dict(self.homework)
+        state['homework_field'] = self.homework_field.copy()
+        state['enemies'] = self.enemies.snapshot()
+        return state
+
+    def restore(self, state):
+        for name in self.SNAPSHOT_FIELDS: setattr(self, name, state[name])
+        self.player.rect.topleft = state['player']
+        self.homework = dict(state['homework'])
+        self.homework_field = state['homework_field'].copy()
+        self.enemies.restore(state['enemies'])
+
+    def step(self, controls):
+        # Advance one fixed step; returns the list of events that happened during it
+        events = []
+        if self.status != "PLAYING": return events
+        self.steps += 1
+        self.ticks = self.steps * STEP_MS
+
+        delay = self.sprint_delay if controls.sprint else self.walk_delay
+        if self.ticks - self.move_timer > delay:
+            dx, dy = 0, 0
+            if controls.left: dx = -TILE_SIZE
+            elif controls.right: dx = TILE_SIZE
+            elif controls.up: dy = -TILE_SIZE
+            elif controls.down: dy = TILE_SIZE
+            if dx or dy:
+                self.player.move(dx, dy, self.solid_grid)
+                self.move_timer = self.ticks
+
+        self.enemies.update()
+        if self.profiler: self.profiler.lap('sim')
+        self.check_interactions(events)
+        if self.profiler: self.profiler.lap('interactions')
+        return events
+
+    def check_interactions(self, events):
+        # The player moves a whole tile at a time, so it always covers exactly one tile: the
+        # paper or goal on that tile is the only one it can touch
+        player_rect = self.player.rect
+        tile = (player_rect.x // TILE_SIZE, player_rect.y // TILE_SIZE)
+        if tile in self.homework:
+            del self.homework[tile]
+            self.homework_field.remove_source(*tile)
+            self.score += 1
+            self.message = f"Homework Collected: {self.score}/{self.total_homework}"
+            events.append('homework')
+        
+        # Enemies are checked in spawn order; after a catch moves the player, the search
+        # carries on from the next enemy against the new position
+        i = self.enemies.first_hit(player_rect, 0)
+        while i != -1:
+            self.lives -= 1
+            self.catches += 1
+            if self.lives > 0:
+                self.player.rect.topleft = self.start_pos
+                self.message = f"Caught! Chances: {self.lives}"
+                events.append('caught')
+                i = self.enemies.first_hit(player_rect, i + 1)
+            else:
+                self.status = "FAILED"
+                events.append('game_over')
+                return
+        
+        if (player_rect.x // TILE_SIZE, player_rect.y // TILE_SIZE) in self.goals:
+            if self.score == self.total_homework:
+                self.status = "CLEARED"
+                events.append('cleared')
+            else:
+                self.message = f"Locked! Need {self.total_homework - self.score} more papers."
+
+def tile_span(rect):
+    # First and last tile column and row that a rect overlaps
+    return rect.left // TILE_SIZE, (rect.right - 1) // TILE_SIZE, rect.top // TILE_SIZE, (rect.bottom - 1) // TILE_SIZE
+
+class SolidGrid:
+    # Occupancy grid of solid tiles (walls and desks), one byte per tile
+    def __init__(self, cols, rows):
+        self.cols, self.rows = cols, rows
+        self.cells = bytearray(cols * rows)
+
+    def set_solid(self, col, row): self.cells[row * self.cols + col] = 1
+
+    def is_solid(self, col, row):
+        if 0 <= col < self.cols and 0 <= row < self.rows: return self.cells[row * self.cols + col] == 1
+        return True
+
+    def collides(self, rect):
+        # Only the 1-4 tiles the rect overlaps need checking (tile_span, inlined: this runs for
+        # every hall monitor on every step)
+        c0, c1 = rect.left // TILE_SIZE, (rect.right - 1) // TILE_SIZE
+        r0, r1 = rect.top // TILE_SIZE, (rect.bottom - 1) // TILE_SIZE
+        if c0 < 0 or r0 < 0 or c1 >= self.cols or r1 >= self.rows: return True
+        cells, cols = self.cells, self.cols
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                if cells[row * cols + col]: return True
+        return False
+
+class DistanceField:
+    # Walking distance (in tiles) from every open tile to the nearest remaining source,
+    # plus which source that is. Removing a source only re-floods the tiles it owned.
+    UNREACHED = -1
+    NEIGHBORS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+    def __init__(self, grid, sources):
+        self.grid = grid
+        self.sources = list(sources)
+        self.source_index = {tile: i for i, tile in enumerate(self.sources)}
+        self.dist = array('i', [self.UNREACHED]) * (grid.cols * grid.rows)
+        self.owner = array('i', [self.UNREACHED]) * (grid.cols * grid.rows)
+        self.flood([(0, i, col, row) for i, (col, row) in enumerate(self.sources)])
+
+    def flood(self, seeds):
+        # Unit-weight Dijkstra from (dist, owner, col, row) seeds, which may start at different distances
+        cols, dist, owner, grid = self.grid.cols, self.dist, self.owner, self.grid
+        heap = list(seeds)
+        heapq.heapify(heap)
+        while heap:
+            d, o, col, row = heapq.heappop(heap)
+            i = row * cols + col
+            if dist[i] != self.UNREACHED and dist[i] <= d: continue
+            dist[i], owner[i] = d, o
+            for dc, dr in self.NEIGHBORS:
+                nc, nr = col + dc, row + dr
+                if grid.is_solid(nc, nr): continue
+                j = nr * cols + nc
+                if dist[j] == self.UNREACHED or dist[j] > d + 1: heapq.heappush(heap, (d + 1, o, nc, nr))
+
+    def remove_source(self, col, row):
+        k = self.source_index.pop((col, row), None)
+        if k is None: return
+        cols, dist, owner = self.grid.cols, self.dist, self.owner
+        cleared = [i for i in range(len(owner)) if owner[i] == k]
+        for i in cleared: dist[i] = owner[i] = self.UNREACHED
+        # Re-seed the cleared region from the tiles around it that other sources still reach
+        seeds = []
+        for i in cleared:
+            col, row = i % cols, i // cols
+            for dc, dr in self.NEIGHBORS:
+                nc, nr = col + dc, row + dr
+                if self.grid.is_solid(nc, nr): continue
+                j = nr * cols + nc
+                if dist[j] != self.UNREACHED: seeds.append((dist[j] + 1, owner[j], col, row))
+        self.flood(seeds)
+
+    def copy(self):
+        field = DistanceField.__new__(DistanceField)
+        field.grid, field.sources = self.grid, self.sources
+        field.source_index = dict(self.source_index)
+        field.dist, field.owner = array('i', self.dist), array('i', self.owner)
+        return field
+
+    def distance(self, col, row):
+        if self.grid.is_solid(col, row): return self.UNREACHED
+        return self.dist[row * self.grid.cols + col]
+
+    def next_step(self, col, row):
+        # Neighbouring tile one step closer to the nearest source, or None if there isn't one
+        here = self.distance(col, row)
+        if here <= 0: return None
+        for dc, dr in self.NEIGHBORS:
+            if self.distance(col + dc, row + dr) == here - 1: return col + dc, row + dr
+        return None
 
 class Player:
     def __init__(self, x, y): self.rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
-    def move(self, dx, dy, walls):
+    def move(self, dx, dy, grid):
         self.rect.x += dx
-        for w in walls: 
-            if self.rect.colliderect(w): self.rect.x -= dx
+        if grid.collides(self.rect): self.rect.x -= dx
         self.rect.y += dy
-        for w in walls: 
-            if self.rect.colliderect(w): self.rect.y -= dy
+        if grid.collides(self.rect): self.rect.y -= dy
 
 class Enemy:
     def __init__(self, x, y, d, speed=1.0):
         self.x = float(x)
         self.y = float(y)
+        self.prev_x, self.prev_y = self.x, self.y
         self.rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
+        self.hitbox = self.rect.inflate(-10, -10)
         self.dir = d
         self.spd = speed 
         self.md = 1 
     
-    def update(self, walls):
+    def draw_rect(self, alpha):
+        # Position between the previous and current simulation step
+        x = self.prev_x + (self.x - self.prev_x) * alpha
+        y = self.prev_y + (self.y - self.prev_y) * alpha
+        return pygame.Rect(int(x), int(y), TILE_SIZE, TILE_SIZE)
+
+    def update(self, grid):
+        self.prev_x, self.prev_y = self.x, self.y
         if self.dir == 'horizontal':
             self.x += self.spd * self.md
             self.rect.x = int(self.x)
-            for w in walls:
-                if self.rect.colliderect(w):
-                    self.md *= -1
-                    self.x += self.spd * self.md 
-                    self.rect.x = int(self.x)
+            if grid.collides(self.rect):
+                self.md *= -1
+                self.x += self.spd * self.md 
+                self.rect.x = int(self.x)
         else:
             self.y += self.spd * self.md
             self.rect.y = int(self.y)
-            for w in walls:
-                if self.rect.colliderect(w):
-                    self.md *= -1
-                    self.y += self.spd * self.md
-                    self.rect.y = int(self.y)
+            if grid.collides(self.rect):
+                self.md *= -1
+                self.y += self.spd * self.md
+                self.rect.y = int(self.y)
+        self.hitbox.center = self.rect.center
+
+class EnemyGroup:
+    # Hall monitors as Enemy objects. Catch checks are one Rect.collidelist over the hitboxes:
+    # that C loop beats keeping a spatial hash up to date even with hundreds of monitors.
+    def __init__(self, spawns, speeds, grid):
+        self.grid = grid
+        self.enemies = [Enemy(c * TILE_SIZE, r * TILE_SIZE, axis, spd) for (c, r, axis), spd in zip(spawns, speeds)]
+        self.hitboxes = [enemy.hitbox for enemy in self.enemies]
+
+    def __len__(self): return len(self.enemies)
+
+    def update(self):
+        grid = self.grid
+        for enemy in self.enemies: enemy.update(grid)
+
+    def snapshot(self):
+        return [(e.x, e.y, e.prev_x, e.prev_y, e.spd, e.md) for e in self.enemies]
+
+    def restore(self, state):
+        for enemy, values in zip(self.enemies, state):
+            enemy.x, enemy.y, enemy.prev_x, enemy.prev_y, enemy.spd, enemy.md = values
+            enemy.rect.topleft = (int(enemy.x), int(enemy.y))
+            enemy.hitbox.center = enemy.rect.center
+
+    def first_hit(self, rect, start):
+        # Lowest index >= start whose hitbox touches rect, or -1
+        if start == 0: return rect.collidelist(self.hitboxes)
+        i = rect.collidelist(self.hitboxes[start:])
+        return i + start if i != -1 else -1
+
+    def draw_rects(self, view, alpha):
+        rects = [enemy.draw_rect(alpha) for enemy in self.enemies]
+        return [rect for rect in rects if view.colliderect(rect)]
+
+class EnemySwarm:
+    # The same patrols as EnemyGroup, stored as NumPy arrays and advanced in one vectorized
+    # step. Each monitor moves along one axis; `along` is its position on that axis and
+    # `across` the fixed tile row/column it patrols. Walls are looked up in a flattened, padded
+    # copy of the solid grid (out of bounds counts as solid), matching Enemy.update exactly.
+    # `speeds` may also be a (runs, monitors) array: then every row is the same level's patrol
+    # in a separate run, all stepped at once (balance.py plays batches of runs this way).
+    def __init__(self, spawns, speeds, grid):
+        self.grid = grid
+        self.horizontal = np.array([axis == 'horizontal' for _, _, axis in spawns], dtype=bool)
+        cols = np.array([c for c, _, _ in spawns], dtype=np.int64)
+        rows = np.array([r for _, r, _ in spawns], dtype=np.int64)
+        self.across = np.where(self.horizontal, rows, cols)
+        self.spd = np.array(speeds, dtype=np.float64)
+        self.along = np.broadcast_to(np.where(self.horizontal, cols, rows).astype(np.float64) * TILE_SIZE, self.spd.shape).copy()
+        self.prev = self.along.copy()
+        self.md = np.ones(self.spd.shape, dtype=np.float64)
+        solid = np.frombuffer(bytes(grid.cells), dtype=np.uint8).reshape(grid.rows, grid.cols)
+        self.solid = np.pad(solid, 1, constant_values=1).astype(bool).ravel()
+        # Tile k (padded) along a monitor's line is at base + k * stride in self.solid
+        width = grid.cols + 2
+        self.base = np.where(self.horizontal, (self.across + 1) * width, self.across + 1)
+        self.stride = np.where(self.horizontal, 1, width)
+        self.hitboxes_at = -1
+
+    def __len__(self): return self.spd.shape[-1]
+
+    def update(self):
+        self.prev[:] = self.along
+        self.along += self.spd * self.md
+        hit = self.blocked(self.along.astype(np.int64))
+        self.md[hit] *= -1
+        self.along[hit] += self.spd[hit] * self.md[hit]
+
+    def snapshot(self):
+        return self.along.copy(), self.prev.copy(), self.spd.copy(), self.md.copy()
+
+    def restore(self, state):
+        for array_, values in zip((self.along, self.prev, self.spd, self.md), state): array_[:] = values
+
+    def select(self, runs):
+        # Keep only the given rows of a (runs, monitors) swarm
+        self.along, self.prev, self.spd, self.md = (a[runs] for a in (self.along, self.prev, self.spd, self.md))
+
+    def blocked(self, pos):
+        # Whether each monitor's 40x40 rect at integer position `pos` overlaps a solid tile
+        lo, hi = pos // TILE_SIZE + 1, (pos + TILE_SIZE - 1) // TILE_SIZE + 1
+        return self.solid[self.base + lo * self.stride] | self.solid[self.base + hi * self.stride]
+
+    def positions(self, along, start=0):
+        # Top-left pixel (x, y) arrays for monitors start.. at the given along-axis positions
+        pos = along.astype(np.int64)
+        fixed = self.across[start:] * TILE_SIZE
+        h = self.horizontal[start:]
+        return np.where(h, pos, fixed), np.where(h, fixed, pos)
+
+    def first_hit(self, rect, start):
+        # Hitboxes are the 40x40 rect inset by 5px, like Enemy.hitbox
+        x, y = self.positions(self.along[start:], start)
+        inset = 5
+        overlap = ((x + inset < rect.right) & (x + TILE_SIZE - inset > rect.left) &
+                   (y + inset < rect.bottom) & (y + TILE_SIZE - inset > rect.top))
+        hits = np.flatnonzero(overlap)
+        return start + int(hits[0]) if hits.size else -1
+
+    def draw_rects(self, view, alpha):
+        x, y = self.positions(self.prev + (self.along - self.prev) * alpha)
+        visible = np.flatnonzero((x < view.right) & (x + TILE_SIZE > view.left) & (y < view.bottom) & (y + TILE_SIZE > view.top))
+        return [pygame.Rect(int(x[i]), int(y[i]), TILE_SIZE, TILE_SIZE) for i in visible]
+
+# --- REPLAYS ---
+# A run is fully determined by its RNG seed and the Controls of every simulation step, so a
+# replay stores just those: inputs are a flat [delta, bits, delta, bits, ...] list where each
+# pair is the number of steps since the previous change and the new Controls.to_bits().
+class Replay:
+    VERSION = 1
+
+    def __init__(self, seed, mode='campaign', level_seed=None):
+        self.seed = seed
+        self.mode, self.level_seed = mode, level_seed  # Which levels were played (see level_source)
+        self.levels = []  # CompiledLevel.fingerprint of each level played by index, None if it was skipped
+        self.inputs = []
+        self.steps = 0
+        self.outcome = None  # "VICTORY" or "GAME_OVER" once the run has ended
+        self.detentions = 0
+        self.last_bits, self.last_change = 0, 0
+        self.decoded = None
+
+    def add_level(self, index, level):
+        self.levels += [None] * (index - len(self.levels)) + [level.fingerprint]
+
+    def record(self, controls):
+        bits = controls.to_bits()
+        if bits != self.last_bits:
+            self.inputs += [self.steps - self.last_change, bits]
+            self.last_bits, self.last_change = bits, self.steps
+            self.decoded = None
+        self.steps += 1
+
+    def controls_at(self, step):
+        if self.decoded is None:
+            # Absolute step of every change, and the bits that hold from then on
+            changes, at = [], 0
+            for i in range(0, len(self.inputs), 2):
+                at += self.inputs[i]
+                changes.append(at)
+            self.decoded = (changes, self.inputs[1::2])
+        changes, bits = self.decoded
+        i = bisect_right(changes, step) - 1
+        return Controls.from_bits(bits[i] if i >= 0 else 0)
+
+    def save(self, path):
+        data = {'version': self.VERSION, 'seed': self.seed, 'mode': self.mode, 'level_seed': self.level_seed,
+                'levels': self.levels, 'steps': self.steps,
+                'outcome': self.outcome, 'detentions': self.detentions, 'inputs': self.inputs}
+        with open(path, 'w', encoding='utf-8') as f: json.dump(data, f, separators=(',', ':'))
+
+def load_replay(path):
+    with open(path, encoding='utf-8') as f: data = json.load(f)
+    if data.get('version') != Replay.VERSION: raise ValueError(f"{path}: unsupported replay version {data.get('version')!r}")
+    replay = Replay(data['seed'], data.get('mode', 'campaign'), data.get('level_seed'))
+    replay.levels, replay.inputs, replay.steps = data['levels'], data['inputs'], data['steps']
+    replay.outcome, replay.detentions = data.get('outcome'), data.get('detentions', 0)
+    return replay
+
+class ReplayRunner:
+    # Re-simulates a replay headless, level after level, as fast as the CPU allows. A snapshot
+    # is kept every REPLAY_SNAPSHOT_STEPS steps, so seek() only re-simulates from the nearest one.
+    def __init__(self, replay, levels=None):
+        self.replay = replay
+        self.levels = levels if levels is not None else level_source(replay.mode, replay.level_seed)
+        self.rng = random.Random(replay.seed)
+        self.level_index = 0
+        self.step = 0
+        self.catches = 0  # Catches in the levels before the current one
+        self.sim = self.load_level(0)
+        self.snapshots = [self.snapshot()]
+
+    def load_level(self, idx):
+        # Skips the same broken levels as the game; the replay has None for each one it skipped
+        self.level_index, level = self.levels.playable(idx)
+        played = [None] * (self.level_index - idx) + [level.fingerprint]
+        recorded = self.replay.levels[idx:self.level_index + 1]
+        if recorded != played[:len(recorded)]: raise ValueError(f"level {idx + 1} has changed since this replay was recorded")
+        return Simulation(level, self.rng)
+
+    @property
+    def done(self): return self.sim.status != "PLAYING"
+
+    def advance(self):
+        self.sim.step(self.replay.controls_at(self.step))
+        self.step += 1
+        # The game loads the next level (drawing from the same rng) as soon as one is cleared
+        if self.sim.status == "CLEARED" and not self.levels.is_last(self.level_index):
+            self.catches += self.sim.catches
+            self.level_index += 1
+            self.sim = self.load_level(self.level_index)
+        if self.step % REPLAY_SNAPSHOT_STEPS == 0 and self.step > self.snapshots[-1][0]:
+            self.snapshots.append(self.snapshot())
+
+    def snapshot(self):
+        return self.step, self.level_index, self.catches, self.rng.getstate(), self.sim.snapshot()
+
+    def seek(self, step):
+        # Always starts over from a snapshot, so it is safe after self.sim was stepped elsewhere
+        i = bisect_right([snapshot[0] for snapshot in self.snapshots], step) - 1
+        self.step, level_index, self.catches, rng_state, state = self.snapshots[i]
+        if level_index != self.level_index:
+            self.level_index = level_index
+            self.sim = self.load_level(level_index)
+        self.rng.setstate(rng_state)
+        self.sim.restore(state)
+        while self.step < step and not self.done: self.advance()
+
+    def run(self):
+        # Play to the end of the recording; returns (outcome, steps, detentions) for checking
+        # against what the replay claims
+        while self.step < self.replay.steps and not self.done: self.advance()
+        if self.sim.status == "FAILED": outcome = "GAME_OVER"
+        elif self.sim.status == "CLEARED": outcome = "VICTORY"
+        else: outcome = None
+        return outcome, self.step, self.catches + self.sim.catches
+
+class ReplayInput:
+    # Input source that plays a replay back through the normal game loop: it presses action
+    # on the title and level-complete screens and feeds the recorded controls while playing.
+    # Past the last recorded step it returns None, as nothing was pressed from there on.
+    def __init__(self, replay):
+        self.replay = replay
+        self.runner = ReplayRunner(replay)
+        self.cursor = 0  # Next step to play
+
+    def read(self, sim):
+        if sim is None or sim.status != "PLAYING": return Controls(action=self.cursor < self.replay.steps)
+        if self.cursor >= self.replay.steps: return None
+        controls = self.replay.controls_at(self.cursor)
+        self.cursor += 1
+        return controls
 
 if __name__ == "__main__":
-    asyncio.run(Game().run())
+    parser = argparse.ArgumentParser(description="Compass High: Ivan's Journey")
+    parser.add_argument('--profile', nargs='?', const='', metavar='TRACE',
+                        help="start with the frame profiler on; with a .csv or .json path, save the trace there on quit")
+    parser.add_argument('--replay', metavar='FILE', help="watch a recorded run (Left/Right to seek)")
+    parser.add_argument('--render-scale', type=lambda v: v if v == 'auto' else float(v), default=RENDER_SCALE,
+                        metavar='SCALE', help="display size as a multiple of 800x600, or 'auto' to adapt it to hold FPS")
+    args, _ = parser.parse_known_args()
+    replay = load_replay(args.replay) if args.replay else None
+    asyncio.run(Game(profile=args.profile, replay=replay, render_scale=args.render_scale).run())
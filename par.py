@@ -0,0 +1,341 @@
+import argparse
+import heapq
+import os
+import random
+import statistics
+import time
+from array import array
+from bisect import bisect_right
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from main import ENEMY_SPEEDS, SIM_RATE, STEP_MS, TILE_SIZE, Controls, DistanceField, Enemy, LevelLibrary, Simulation
+
+# Par times: the fastest possible clear of each level without getting caught, found by
+# solve_par for the hall monitor speeds that a given seed draws. Speeds are random per
+# run, so each level is solved for a range of seeds and the spread is reported. Levels with
+# many papers may run out of search budget (PAR_MAX_NODES), and then only get an upper bound.
+#
+#   python par.py
+#   python par.py --levels 4 --seeds 100 --check
+
+TRAJECTORY_MAX_STEPS = 1 << 16  # Longest hall monitor patrol that is tabulated before giving up on finding its cycle
+PAR_MAX_STEPS = SIM_RATE * 600  # Routes slower than 10 minutes of play are not searched
+PAR_MAX_NODES = 20000  # States the exact par search expands before settling for a route taking the papers in a fixed order
+
+# Once their speeds are drawn, hall monitor patrols are fixed, so the fastest safe way through a
+# level can be searched for offline and used as its par time.
+class Trajectory:
+    # Pixel position along its axis of one hall monitor after each step from spawn. The patrol
+    # repeats once a (position, direction) state comes round again, so only the steps up to
+    # that point are stored and later steps wrap around the cycle.
+    def __init__(self, col, row, axis, speed, grid, max_steps=TRAJECTORY_MAX_STEPS):
+        self.horizontal = axis == 'horizontal'
+        enemy = Enemy(col * TILE_SIZE, row * TILE_SIZE, axis, speed)
+        self.positions = array('i')
+        self.start = self.period = None
+        self.hits = None
+        seen = {}
+        for step in range(max_steps):
+            state = (enemy.x, enemy.y, enemy.md)
+            if state in seen:
+                self.start = seen[state]
+                self.period = step - self.start
+                break
+            seen[state] = step
+            self.positions.append(enemy.rect.x if self.horizontal else enemy.rect.y)
+            enemy.update(grid)
+
+    def hit_runs(self):
+        # {tile index along the axis: inclusive (first, last) step runs within the table when
+        # the hitbox (the rect inset by 5px) overlaps that tile}, worked out once per table
+        if self.hits is not None: return self.hits
+        open_runs, self.hits = {}, {}
+        for step, pos in enumerate(self.positions):
+            for tile in range((pos + 5) // TILE_SIZE, (pos + TILE_SIZE - 6) // TILE_SIZE + 1):
+                run = open_runs.get(tile)
+                if run and run[1] == step - 1: run[1] = step
+                else:
+                    if run: self.hits.setdefault(tile, []).append(tuple(run))
+                    open_runs[tile] = [step, step]
+        for tile, run in open_runs.items(): self.hits.setdefault(tile, []).append(tuple(run))
+        return self.hits
+
+    def at(self, step):
+        # None past the end of a patrol whose cycle was not found
+        if step < len(self.positions): return self.positions[step]
+        if self.period is None: return None
+        return self.positions[self.start + (step - self.start) % self.period]
+
+TRAJECTORIES = {}  # (level fingerprint, monitor index, speed): Trajectory, shared by every solve
+
+def trajectory(level, index, speed):
+    # Patrol table of one hall monitor at one speed, built the first time it is needed
+    key = (level.fingerprint, index, speed)
+    if key not in TRAJECTORIES: TRAJECTORIES[key] = Trajectory(*level.enemies[index], speed, level.solid_grid)
+    return TRAJECTORIES[key]
+
+DIRECTION_OFFSETS = {'left': (-1, 0), 'right': (1, 0), 'up': (0, -1), 'down': (0, 1)}
+
+def patrol_threats(level):
+    # For every open tile, the hall monitors whose hitbox can ever reach it, as (enemy index,
+    # index of the tile along that monitor's axis). A monitor stays between the walls either
+    # side of its spawn, so this needs no trajectories.
+    grid = level.solid_grid
+    threats = {}
+    for i, (col, row, axis) in enumerate(level.enemies):
+        dc, dr = (1, 0) if axis == 'horizontal' else (0, 1)
+        lo = 0
+        while not grid.is_solid(col - (lo + 1) * dc, row - (lo + 1) * dr): lo += 1
+        hi = 0
+        while not grid.is_solid(col + (hi + 1) * dc, row + (hi + 1) * dr): hi += 1
+        for k in range(-lo, hi + 1):
+            tile = (col + k * dc, row + k * dr)
+            threats.setdefault(tile, []).append((i, tile[0] if dc else tile[1]))
+    return threats
+
+class ParSolver:
+    # Fastest clear of a CompiledLevel without being caught, for hall monitor speeds given in
+    # spawn order (as Simulation draws them). The player always sprints, so it can move every
+    # move_steps steps and sits on each tile it enters for at least that long.
+    #
+    # A* over (tile, homework collected, time), with time handled as safe intervals: each tile's
+    # timeline splits into runs of steps where no hitbox can touch it, and arriving earlier in
+    # the same run is never worse, because the player can wait there until the run ends. So a
+    # state is (tile, papers, step by which it must leave) and its cost is the step at which
+    # it is first free to move; waiting never creates states of its own.
+    def __init__(self, level, speeds, max_steps=PAR_MAX_STEPS):
+        self.level, self.speeds, self.max_steps = level, speeds, max_steps
+        self.grid = level.solid_grid
+        self.move_steps = int(Simulation.sprint_delay // STEP_MS) + 1
+        self.threats = patrol_threats(level)
+        self.safe_cache = {}
+        self.neighbors = {}
+
+        # Heuristic: the rest of the route runs from the player's tile through every remaining
+        # paper to a goal, so it is at least as long (in moves) as a minimum spanning tree
+        # over those points, with all the goals merged into one node
+        self.goal_field = level.goal_field
+        self.fields = [DistanceField(self.grid, [tile]) for tile in level.homework]
+        self.to_goal = [self.goal_field.distance(*tile) for tile in level.homework]
+        self.between = [[field.distance(*tile) for tile in level.homework] for field in self.fields]
+        self.estimates = {}
+
+    def open_neighbors(self, tile):
+        if tile not in self.neighbors:
+            steps = [(d, (tile[0] + dc, tile[1] + dr)) for d, (dc, dr) in DIRECTION_OFFSETS.items()]
+            self.neighbors[tile] = [(d, t) for d, t in steps if not self.grid.is_solid(*t)]
+        return self.neighbors[tile]
+
+    def unsafe_runs(self, trajectory, tile):
+        # Inclusive (first, last) step runs up to max_steps when the monitor's hitbox overlaps
+        # the tile at index `tile` along its axis
+        runs = list(trajectory.hit_runs().get(tile, ()))
+        if trajectory.period is None: return runs + [(len(trajectory.positions), self.max_steps)]
+        # Later laps repeat the cycle part of the table
+        cycle = [(max(a, trajectory.start), b) for a, b in runs if b >= trajectory.start]
+        offset = trajectory.period
+        while cycle and cycle[0][0] + offset <= self.max_steps:
+            runs += [(a + offset, b + offset) for a, b in cycle]
+            offset += trajectory.period
+        return runs
+
+    def safe_intervals(self, tile):
+        # Inclusive (first, last) runs of steps in 1..max_steps when the tile is safe to stand on
+        if tile in self.safe_cache: return self.safe_cache[tile]
+        unsafe = []
+        for i, along in self.threats.get(tile, ()):
+            unsafe += self.unsafe_runs(trajectory(self.level, i, self.speeds[i]), along)
+        intervals, step = [], 1
+        for a, b in sorted(unsafe):
+            if a > step: intervals.append((step, a - 1))
+            step = max(step, b + 1)
+        if step <= self.max_steps: intervals.append((step, self.max_steps))
+        self.safe_cache[tile] = (intervals, [b for _, b in intervals])
+        return self.safe_cache[tile]
+
+    def estimate(self, tile, mask):
+        # Lower bound on the steps left before a state's tile and papers can finish the level
+        key = (tile, mask)
+        if key in self.estimates: return self.estimates[key]
+        # Prim's algorithm; the player's tile and the merged goal node start out connected
+        remaining = [i for i in range(len(self.fields)) if not mask >> i & 1]
+        best = {i: min(self.fields[i].distance(*tile), self.to_goal[i]) for i in remaining}
+        moves = self.goal_field.distance(*tile) if not remaining else 0
+        while best:
+            i = min(best, key=best.get)
+            moves += best.pop(i)
+            for j in best: best[j] = min(best[j], self.between[i][j])
+        self.estimates[key] = max(0, moves - 1) * self.move_steps
+        return self.estimates[key]
+
+    def search(self, first, ready, paper=None, max_nodes=None):
+        # A* from state `first`, free to move at step `ready`, to the end of the level, or if
+        # `paper` is given, to the first state holding that paper. Returns (state, step, moves)
+        # with moves as (step, direction) pairs, or None if there is no route within max_steps
+        # or more than max_nodes states get expanded (self.expanded tells which).
+        level, k = self.level, self.move_steps
+        goals = set(level.goals)
+        bit = {tile: 1 << i for i, tile in enumerate(level.homework)}
+        full = (1 << len(level.homework)) - 1
+        want = 0 if paper is None else 1 << paper
+        best, came_from, heap = {first: ready}, {first: None}, []
+        self.expanded = 0
+
+        def estimate(tile, collected):
+            if not want: return self.estimate(tile, collected)
+            # Moves to the paper, each one a full sprint move as the leg ends on a normal state
+            return 0 if collected & want else self.fields[paper].distance(*tile) * k
+
+        def move(parent, ready, leave_by, direction, target, run):
+            # Queue the move into `target` in its first safe run (from index `run`) that can
+            # still be reached. Later runs can only be reached later, so rather than queueing
+            # them all now, a marker is queued to come back for them if it ever gets that far.
+            collected = parent[1] | bit.get(target, 0)
+            done = collected == full and target in goals
+            h = 0 if done else estimate(target, collected)
+            intervals, ends = self.safe_intervals(target)
+            if run == 0: run = bisect_right(ends, ready - 1)
+            for run in range(run, len(intervals)):
+                first_step, last_step = intervals[run]
+                depart = max(ready, first_step)
+                if depart > leave_by: return
+                if done:
+                    # Papers and catches are checked before the goal on the step of the move
+                    nxt, cost = (target, -1, depart), depart
+                elif depart + k - 1 <= last_step:
+                    nxt, cost = (target, collected, min(last_step + 1, self.max_steps)), depart + k
+                else: continue
+                if cost < best.get(nxt, self.max_steps + 1):
+                    best[nxt] = cost
+                    came_from[nxt] = (parent, direction, depart)
+                    heapq.heappush(heap, (cost + h, cost, 0, nxt))
+                if not done: heapq.heappush(heap, (cost + h, cost, 1, (parent, ready, leave_by, direction, target, run + 1)))
+                return
+
+        heap.append((ready + estimate(first[0], first[1]), ready, 0, first))
+        while heap:
+            _, ready, resume, key = heapq.heappop(heap)
+            if resume:
+                move(*key)
+                continue
+            if key[1] < 0 or key[1] & want: break
+            if best[key] < ready: continue
+            self.expanded += 1
+            if max_nodes is not None and self.expanded > max_nodes: return None
+            for direction, target in self.open_neighbors(key[0]):
+                move(key, ready, key[2], direction, target, 0)
+        else:
+            return None
+
+        end, moves = key, []
+        while came_from[key] is not None:
+            key, direction, depart = came_from[key]
+            moves.append((depart, direction))
+        moves.reverse()
+        return end, ready, moves
+
+    def solve(self, max_nodes=PAR_MAX_NODES):
+        # Returns (steps, moves, exact), or None if no route finishes within max_steps. Steps
+        # are 1-based like Simulation.steps. The full search is exponential in the number of
+        # papers, so past max_nodes expanded states it gives up and the route instead takes the
+        # papers in a fixed order (see tour), each leg as fast as it can be: exact is then False
+        # and the par only an upper bound.
+        start = self.level.player_start
+        if self.goal_field.distance(*start) < 0: return None
+        if any(d < 0 or f.distance(*start) < 0 for d, f in zip(self.to_goal, self.fields)): return None
+        # The start tile can be left at step 1, or held for as long as it stays safe
+        intervals, ends = self.safe_intervals(start)
+        first = (start, 0, intervals[0][1] + 1 if intervals and intervals[0][0] == 1 else 1)
+        route = self.search(first, 1, max_nodes=max_nodes)
+        if route: return route[1], route[2], True
+        if max_nodes is None or self.expanded <= max_nodes: return None
+
+        state, ready, moves = first, 1, []
+        for paper in self.tour() + [None]:
+            if paper is not None and state[1] >> paper & 1: continue  # Picked up on the way
+            route = self.search(state, ready, paper)
+            if route is None: return None
+            state, ready, leg = route
+            moves += leg
+        return ready, moves, False
+
+    def tour(self):
+        # Order of the papers for the shortest walk from the start through them all to a goal,
+        # ignoring hall monitors: nearest paper first, then stretches of the order are reversed
+        # while that makes the walk shorter (2-opt)
+        n, start = len(self.fields), self.level.player_start
+        dist = [row + [self.fields[i].distance(*start), self.to_goal[i]] for i, row in enumerate(self.between)]
+        dist.append([field.distance(*start) for field in self.fields] + [0, self.goal_field.distance(*start)])
+        dist.append(self.to_goal + [self.goal_field.distance(*start), 0])
+        path, left = [n], set(range(n))
+        while left:
+            nearest = min(left, key=lambda j: dist[path[-1]][j])
+            path.append(nearest)
+            left.remove(nearest)
+        path.append(n + 1)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(1, n):
+                for j in range(i + 1, n + 1):
+                    a, b, c, d = path[i - 1], path[i], path[j], path[j + 1]
+                    if dist[a][c] + dist[b][d] < dist[a][b] + dist[c][d]:
+                        path[i:j + 1] = path[j:i - 1:-1]
+                        improved = True
+        return path[1:-1]
+
+def solve_par(level, speeds, max_steps=PAR_MAX_STEPS, max_nodes=PAR_MAX_NODES):
+    return ParSolver(level, speeds, max_steps).solve(max_nodes)
+
+def draw_speeds(level, seed):
+    # The speeds Simulation(level, random.Random(seed)) gives its hall monitors
+    rng = random.Random(seed)
+    return [rng.choice(ENEMY_SPEEDS) for _ in level.enemies]
+
+def check_route(level, seed, steps, moves):
+    # Play the route through a real Simulation: it must clear on the last step, never caught
+    sim = Simulation(level, random.Random(seed))
+    turns = dict(moves)
+    for step in range(1, steps + 1):
+        direction = turns.get(step)
+        sim.step(Controls(sprint=True, **({direction: True} if direction else {})))
+    return sim.status == "CLEARED" and sim.steps == steps and sim.catches == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute par times for each level.")
+    parser.add_argument('--levels', type=int, nargs='+', help="level numbers (1-based, default: all)")
+    parser.add_argument('--seeds', type=int, default=20, help="speed draws per level")
+    parser.add_argument('--seed', type=int, default=0, help="first seed")
+    parser.add_argument('--check', action='store_true', help="play every route through the simulation to confirm it")
+    args = parser.parse_args()
+
+    library = LevelLibrary()
+    levels = [n - 1 for n in args.levels] if args.levels else list(range(len(library)))
+    failed = 0
+    for level_idx in levels:
+        level = library.get(level_idx)
+        pars, unsolved, inexact, started = [], 0, 0, time.perf_counter()
+        for seed in range(args.seed, args.seed + args.seeds):
+            route = solve_par(level, draw_speeds(level, seed))
+            if route is None:
+                unsolved += 1
+                continue
+            steps, moves, exact = route
+            inexact += not exact
+            if args.check and not check_route(level, seed, steps, moves):
+                print(f"  seed {seed}: route for {steps / SIM_RATE:.2f}s does not replay")
+                failed += 1
+            pars.append(steps / SIM_RATE)
+        elapsed = (time.perf_counter() - started) / args.seeds
+
+        label = f"Level {level_idx + 1}" + (f" ({level.name})" if level.name else "")
+        if pars:
+            print(f"{label}: par {statistics.median(pars):.2f}s  (best {min(pars):.2f}s, worst {max(pars):.2f}s "
+                  f"over {len(pars)} speed draws, {elapsed * 1000:.0f} ms each)")
+        if inexact: print(f"{label}: search budget ran out for {inexact} of {args.seeds} speed draws; those pars are upper bounds")
+        if unsolved: print(f"{label}: no safe route within the step limit for {unsolved} of {args.seeds} speed draws")
+    if failed: raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from main import SIM_RATE, TILE_SIZE, Controls, ReplayRunner, load_replay
+
+# Headless replay checker: re-simulates recorded runs far faster than real time and checks
+# the result the replay claims (outcome, play time, detentions), e.g. before accepting a
+# leaderboard time. --at prints the state of a run at a moment of play for bug reports.
+#
+#   python replay.py replays/*.json
+#   python replay.py replays/run-20240101-120000.json --at 42.5
+
+def describe(runner):
+    sim = runner.sim
+    px, py = sim.player.rect.topleft
+    controls = runner.replay.controls_at(runner.step)
+    held = [name for name in Controls.FIELDS if getattr(controls, name)]
+    print(f"  step {runner.step} ({runner.step / SIM_RATE:.2f}s)  level {runner.level_index + 1}  status {sim.status}")
+    print(f"  player at tile ({px // TILE_SIZE}, {py // TILE_SIZE})  lives {sim.lives}  homework left {len(sim.homework)}")
+    print(f"  controls: {' '.join(held) or 'none'}")
+    # Hall monitors within two tiles of the player
+    near = sim.player.rect.inflate(4 * TILE_SIZE, 4 * TILE_SIZE)
+    for rect in sim.enemies.draw_rects(near, 1.0):
+        print(f"  hall monitor at ({rect.x}, {rect.y}) px, tile ({rect.centerx // TILE_SIZE}, {rect.centery // TILE_SIZE})")
+
+def verify(path, at=None):
+    replay = load_replay(path)
+    started = time.perf_counter()
+    try:
+        runner = ReplayRunner(replay)
+        if at is not None:
+            runner.seek(int(at * SIM_RATE))
+            print(f"{path}:")
+            describe(runner)
+            return True
+        outcome, steps, detentions = runner.run()
+    except ValueError as e:
+        print(f"{path}: FAILED - {e}")
+        return False
+    elapsed = time.perf_counter() - started
+
+    claimed = (replay.outcome, replay.steps, replay.detentions)
+    ok = (outcome, steps, detentions) == claimed
+    print(f"{path}: {'ok' if ok else 'MISMATCH'} - {outcome} after {steps / SIM_RATE:.2f}s of play, "
+          f"{detentions} detentions (checked in {elapsed:.2f}s, {steps / SIM_RATE / max(elapsed, 1e-9):.0f}x real time)")
+    if not ok: print(f"  replay claims {claimed[0]} after {claimed[1] / SIM_RATE:.2f}s, {claimed[2]} detentions")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify recorded runs by re-simulating them headless.")
+    parser.add_argument('replays', nargs='+', help="replay files written by the game")
+    parser.add_argument('--at', type=float, metavar='SECONDS', help="print the state of each run at this much play time instead")
+    args = parser.parse_args()
+
+    results = [verify(path, args.at) for path in args.replays]
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+from main import MAX_STEPS_PER_FRAME, REPLAY_DIR, SIM_RATE, TILE_SIZE, Controls, Replay, Simulation, new_run
+from balance import SeekPolicy
+
+# Classroom race server: every student's game runs headless in this one process, and the server
+# owns the clock. One asyncio loop steps all sessions SIM_RATE times a second. Sessions share one
+# level source, so each level is compiled once and read by everyone, and one seed, so everyone
+# meets the same hall monitor speeds. Players connect over TCP; --bots adds in-process players.
+#
+#   python server.py --players 30
+#   python server.py --mode daily --bots 30 --countdown 0
+#
+# Protocol, one JSON object per line. The client sends {"name": "Ivan"} once, then {"input": bits}
+# whenever its held buttons change (bits as in Controls.to_bits). The server sends "welcome",
+# "countdown", "start", "level" (each map as the player reaches it), "state" (every STATE_EVERY
+# steps), "standings" (once a second) and "finished". Every run is saved as a replay, so results
+# can be checked with replay.py.
+
+STATE_EVERY = 3  # Steps between state messages (20 a second)
+SEND_BUFFER_LIMIT = 1 << 16  # Clients this many bytes behind on reading are disconnected
+NAME_LENGTH = 20
+
+class Session:
+    # One player's run: their own Simulation (player, hall monitors, homework, lives) and Replay,
+    # stepped by the race with the buttons last received from their transport
+    def __init__(self, race, number, name, send, policy=None):
+        self.race, self.number, self.name, self.send = race, number, name, send
+        self.policy = policy  # In-process players pick their own buttons each step
+        self.rng = random.Random(race.seed)
+        self.replay = Replay(race.seed, race.mode, race.level_seed)
+        self.controls = Controls()
+        self.held = self.pressed = 0
+        self.level_index = 0
+        self.catches = 0  # Catches in the levels before the current one
+        self.sim = None
+        self.outcome = None  # "VICTORY", "GAME_OVER" or "TIME_UP" once the run is over
+        self.left = False
+
+    @property
+    def active(self): return self.sim is not None and self.outcome is None and not self.left
+
+    @property
+    def detentions(self): return self.catches + (self.sim.catches if self.sim else 0)
+
+    def set_input(self, bits):
+        # Buttons pressed since the last step count for one step even if already let go
+        self.pressed |= bits & ~self.held
+        self.held = bits
+
+    def load_level(self, idx):
+        self.level_index, level = self.race.levels.playable(idx)
+        self.sim = Simulation(level, self.rng)
+        self.replay.add_level(self.level_index, level)
+        self.send({'type': 'level', 'index': self.level_index, 'name': level.name, 'tiles': level.tiles})
+
+    def step(self):
+        # Same order as the game and ReplayRunner, so the saved replay re-simulates exactly
+        if self.policy: self.set_input(self.policy.read(self.sim).to_bits())
+        controls = self.controls.set_bits(self.held | self.pressed)
+        self.pressed = 0
+        self.replay.record(controls)
+        events = self.sim.step(controls)
+        if 'game_over' in events: self.finish("GAME_OVER")
+        elif 'cleared' in events:
+            if self.race.levels.is_last(self.level_index): self.finish("VICTORY")
+            else:
+                self.catches += self.sim.catches
+                self.load_level(self.level_index + 1)
+
+    def finish(self, outcome):
+        self.outcome = outcome
+        self.replay.outcome = outcome if outcome != "TIME_UP" else None
+        self.replay.detentions = self.detentions
+        self.send({'type': 'finished', 'outcome': outcome, 'steps': self.replay.steps, 'detentions': self.detentions})
+
+    def state(self):
+        sim = self.sim
+        everywhere = pygame.Rect(0, 0, sim.solid_grid.cols * TILE_SIZE, sim.solid_grid.rows * TILE_SIZE)
+        return {'type': 'state', 'step': self.replay.steps, 'level': self.level_index,
+                'player': sim.player.rect.topleft, 'lives': sim.lives, 'message': sim.message,
+                'homework': sorted(sim.homework), 'enemies': [r.topleft for r in sim.enemies.draw_rects(everywhere, 1.0)]}
+
+class Race:
+    def __init__(self, mode='campaign', seed=None):
+        self.seed, self.level_seed, self.levels = new_run(mode, seed)
+        self.mode = mode
+        self.sessions = []
+        self.joined = 0  # Session numbers only ever go up, so players who leave early never share one
+        self.started = False
+        self.steps = 0
+        self.tick_time = 0.0  # Seconds spent stepping sessions, for the closing report
+
+    def join(self, name, send, policy=None):
+        self.joined += 1
+        session = Session(self, self.joined, name, send, policy)
+        self.sessions.append(session)
+        send({'type': 'welcome', 'player': session.number, 'mode': self.mode, 'seed': self.seed, 'level_seed': self.level_seed})
+        # Latecomers start straight away; play time is counted per session, so they lose nothing
+        if self.started:
+            send({'type': 'start'})
+            session.load_level(0)
+        return session
+
+    def leave(self, session):
+        # Finished runs keep their result; unfinished ones stop and show as LEFT
+        session.left = session.outcome is None
+        session.send = lambda message: None
+        if not self.started: self.sessions.remove(session)
+
+    def broadcast(self, message):
+        for session in self.sessions: session.send(message)
+
+    def start(self):
+        self.started = True
+        self.broadcast({'type': 'start'})
+        for session in self.sessions: session.load_level(0)
+
+    def tick(self):
+        started = time.perf_counter()
+        for session in self.sessions:
+            if session.active: session.step()
+        self.steps += 1
+        self.tick_time += time.perf_counter() - started
+        if self.steps % STATE_EVERY == 0:
+            for session in self.sessions:
+                if session.active: session.send(session.state())
+        if self.steps % SIM_RATE == 0: self.broadcast({'type': 'standings', 'rows': self.standings()})
+
+    def standings(self):
+        # Finished runs by time, then everyone else by how far they got
+        def rank(s):
+            if s.outcome == "VICTORY": return (0, s.replay.steps)
+            papers = s.sim.score if s.sim else 0
+            return (1, -s.level_index, -papers, s.replay.steps)
+        rows = []
+        for s in sorted(self.sessions, key=rank):
+            rows.append({'name': s.name, 'level': s.level_index + 1, 'papers': s.sim.score if s.sim else 0,
+                         'time': round(s.replay.steps / SIM_RATE, 2), 'detentions': s.detentions,
+                         'outcome': 'LEFT' if s.left else s.outcome})
+        return rows
+
+    async def run(self, players=1, countdown=5.0, time_limit=None):
+        while len(self.sessions) < players: await asyncio.sleep(0.1)
+        self.broadcast({'type': 'countdown', 'seconds': countdown})
+        await asyncio.sleep(countdown)
+        self.start()
+
+        # Fixed timestep, as in Game.run: after a stall the backlog is dropped, not fast-forwarded
+        step = 1.0 / SIM_RATE
+        max_steps = int(time_limit * SIM_RATE) if time_limit else None
+        next_tick = time.perf_counter()
+        while any(s.active for s in self.sessions) and (max_steps is None or self.steps < max_steps):
+            steps = 0
+            while time.perf_counter() >= next_tick and steps < MAX_STEPS_PER_FRAME:
+                self.tick()
+                next_tick += step
+                steps += 1
+            if time.perf_counter() >= next_tick: next_tick = time.perf_counter()
+            await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+        for session in self.sessions:
+            if session.active: session.finish("TIME_UP")
+        self.broadcast({'type': 'standings', 'rows': self.standings(), 'final': True})
+
+    def save_replays(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for s in self.sessions:
+            if s.sim is None: continue
+            name = re.sub(r'[^A-Za-z0-9_-]+', '_', s.name)
+            s.replay.save(os.path.join(directory, f"race-{stamp}-{s.number:02}-{name}.json"))
+
+async def serve_tcp(race, host, port):
+    # Each connection is one player; a line that isn't JSON, or a client that stops reading,
+    # ends the connection (the session stays in the standings as LEFT). Returns the server and
+    # the set of open connections, so they can be closed once the race is over.
+    writers = set()
+
+    async def handle(reader, writer):
+        writers.add(writer)
+        def send(message):
+            if writer.is_closing(): return
+            if writer.transport.get_write_buffer_size() > SEND_BUFFER_LIMIT:
+                writer.close()
+                return
+            writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+        session = None
+        try:
+            async for line in reader:
+                try: message = json.loads(line)
+                except ValueError: break
+                if not isinstance(message, dict): break
+                if session is None: session = race.join(str(message.get('name') or "Player")[:NAME_LENGTH], send)
+                elif isinstance(message.get('input'), int): session.set_input(message['input'] & 0b111111)
+        except (ConnectionError, ValueError, TypeError):
+            pass
+        finally:
+            writers.discard(writer)
+            if session: race.leave(session)
+            writer.close()
+    return await asyncio.start_server(handle, host, port), writers
+
+async def main():
+    parser = argparse.ArgumentParser(description="Host a classroom race: many headless sessions in one process.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--mode', choices=['campaign', 'daily', 'endless'], default='campaign')
+    parser.add_argument('--seed', type=int, help="hall monitor seed (default: random, or the date's for daily)")
+    parser.add_argument('--players', type=int, default=1, help="players (bots included) to wait for before the countdown")
+    parser.add_argument('--countdown', type=float, default=5.0, help="seconds of countdown once enough players have joined")
+    parser.add_argument('--time-limit', type=float, metavar='SECONDS', help="end the race after this much play time")
+    parser.add_argument('--bots', type=int, default=0, help="in-process players that walk straight to the homework")
+    parser.add_argument('--replays', default=REPLAY_DIR, help="where to save every run's replay")
+    args = parser.parse_args()
+
+    race = Race(args.mode, args.seed)
+    server, connections = await serve_tcp(race, args.host, args.port)
+    print(f"Race ({args.mode}, seed {race.seed}) listening on {args.host}:{args.port}")
+    for i in range(args.bots):
+        race.join(f"Bot {i + 1}", lambda message: None, SeekPolicy(random.Random(i), detour=0.02))
+
+    async with server:
+        started = time.process_time()
+        await race.run(max(args.players, 1), args.countdown, args.time_limit)
+        cpu = time.process_time() - started
+        for writer in list(connections): writer.close()
+        while connections: await asyncio.sleep(0.01)
+    race.save_replays(args.replays)
+
+    for place, row in enumerate(race.standings(), 1):
+        result = f"{row['time']:.2f}s" if row['outcome'] == "VICTORY" else f"{row['outcome'] or 'racing'} on level {row['level']}"
+        print(f"{place:3}. {row['name']:<{NAME_LENGTH}} {result:<24} papers {row['papers']:2}  detentions {row['detentions']}")
+    if race.steps:
+        ms = race.tick_time / race.steps * 1000
+        print(f"{len(race.sessions)} sessions, {race.steps / SIM_RATE:.1f}s: {ms:.3f} ms per tick stepping them, "
+              f"{cpu / (race.steps / SIM_RATE):.1%} of one core in all")
+
+if __name__ == "__main__":
+    asyncio.run(main())
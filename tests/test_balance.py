@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+pytest.importorskip("numpy")
+
+import balance
+
+@pytest.mark.parametrize("policy", sorted(balance.POLICIES))
+def test_batched_runs_end_like_single_runs(policy):
+    # RunBatch decodes each run's random.Random output itself, so any drift from
+    # Simulation shows up as a seed ending differently
+    for level_idx in (0, 3):
+        seeds = range(20)
+        single = [balance.play(level_idx, seed, policy, 10) for seed in seeds]
+        batched = balance.RunBatch(balance.LEVELS.get(level_idx), seeds, policy, 10 * balance.SIM_RATE).play()
+        assert batched == single
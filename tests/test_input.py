@@ -0,0 +1,40 @@
+import os
+import types
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from main import STEP_MS, TILE_SIZE, KeyboardInput, Simulation
+
+CORRIDOR = [
+    "WWWWWWWWWW",
+    "WP......OW",
+    "WWWWWWWWWW",
+]
+
+def tap(keyboard, key):
+    keyboard.handle_event(pygame.event.Event(pygame.KEYDOWN, key=key))
+    keyboard.handle_event(pygame.event.Event(pygame.KEYUP, key=key))
+
+def test_three_taps_while_walking_move_three_tiles():
+    # Walking takes 10 steps (167 ms) per tile, so the third tap waits about 333 ms in the
+    # queue: longer than INPUT_BUFFER_MS, but only half of that at the front of the queue
+    sim = Simulation(CORRIDOR)
+    keyboard = KeyboardInput(types.SimpleNamespace(on_change=None))
+    now = [0.0]
+    keyboard.clock = lambda: now[0]
+    start = sim.player.rect.x
+    for step in range(40):
+        if step < 3: tap(keyboard, pygame.K_RIGHT)
+        sim.step(keyboard.read(sim))
+        now[0] += STEP_MS / 1000
+    assert sim.player.rect.x - start == 3 * TILE_SIZE
+
+def test_tap_between_steps_still_moves():
+    sim = Simulation(CORRIDOR)
+    keyboard = KeyboardInput(types.SimpleNamespace(on_change=None))
+    start = sim.player.rect.x
+    tap(keyboard, pygame.K_RIGHT)
+    sim.step(keyboard.read(sim))
+    assert sim.player.rect.x - start == TILE_SIZE